@@ -8,6 +8,7 @@ import re
 from dataclasses import dataclass
 from decimal import Decimal, InvalidOperation
 from difflib import SequenceMatcher
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple, TypedDict
 
@@ -153,6 +154,12 @@ def _resolve_pc_id(session: Any) -> Optional[str]:
     return None
 
 
+@lru_cache(maxsize=2048)
+def _normalize_mapping_text(value: str) -> str:
+    collapsed = " ".join((value or "").strip().split())
+    return collapsed.upper()
+
+
 class Mapping:
     """Управлява локалните съответствия между доставчици и материали."""
 
@@ -165,10 +172,8 @@ class Mapping:
     # -------------------------
     # Нормализация
     # -------------------------
-    @staticmethod
-    def normalize_text(value: str) -> str:
-        collapsed = " ".join((value or "").strip().split())
-        return collapsed.upper()
+    # Един и същ текст от OCR се нормализира многократно – кешираме на ниво модул.
+    normalize_text = staticmethod(_normalize_mapping_text)
 
     @staticmethod
     def _normalize_supplier(value: Any) -> str:
@@ -327,6 +332,31 @@ class DbItemResolver:
             return None
         return ItemHit(code=str(row[0]), name=str(row[1] or ""))
 
+    # Firebird ограничава IN списъка до 1500 елемента.
+    _IN_BATCH_SIZE = 1000
+
+    def resolve_barcodes(self, barcodes: Iterable[str]) -> Dict[str, ItemHit]:
+        """Резолвира много баркодове с по една IN (...) заявка на пакет."""
+
+        values = list(dict.fromkeys(v for v in ((b or "").strip() for b in barcodes) if v))
+        hits: Dict[str, ItemHit] = {}
+        for start in range(0, len(values), self._IN_BATCH_SIZE):
+            batch = values[start : start + self._IN_BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in batch)
+            sql = (
+                f"SELECT b.{self._barcode_code_col}, m.{self._material_code_col}, "
+                f"m.{self._material_name_col} "
+                f"FROM {self._materials_table} m "
+                f"JOIN {self._barcode_table} b ON b.{self._barcode_fk_col} = m.{self._material_code_col} "
+                f"WHERE b.{self._barcode_code_col} IN ({placeholders})"
+            )
+            self._cur.execute(sql, tuple(batch))
+            for row in self._cur.fetchall() or []:
+                barcode = str(row[0] or "").strip()
+                if barcode and barcode not in hits:
+                    hits[barcode] = ItemHit(code=str(row[1]), name=str(row[2] or ""))
+        return hits
+
     def resolve_by_name(self, fragment: str, limit: int = 20) -> List[ItemHit]:
         pattern = (fragment or "").strip()
         if not pattern:
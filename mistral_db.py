@@ -1,125 +1,267 @@
 """Utility helpers for talking to a Mistral (Firebird) database."""
 from __future__ import annotations
 
+import binascii
 import ctypes
 import hashlib
+import hmac
 import ipaddress
+import logging
 import os
 import sys
+import threading
+import time
 from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import date, datetime
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from itertools import groupby
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Protocol, Sequence, Tuple, Type, runtime_checkable
 
 import re
 
-try:  # pragma: no cover - optional dependency
-    from loguru import logger
-except Exception:  # pragma: no cover - защитно
-    import logging
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-    )
-
-    class _FauxLogger:
-        """Лек заместител на loguru.logger при липсващ пакет."""
+class _FauxLogger:
+    """Лек заместител на loguru.logger при липсващ пакет."""
 
-        def __init__(self) -> None:
-            self._handlers: List[logging.Handler] = []
+    def __init__(self) -> None:
+        self._handlers: List[logging.Handler] = []
 
-        @staticmethod
-        def _format(message: Any, args: Tuple[Any, ...]) -> str:
-            text = str(message)
-            if not args:
-                return text
+    @staticmethod
+    def _format(message: Any, args: Tuple[Any, ...]) -> str:
+        text = str(message)
+        if not args:
+            return text
+        try:
+            return text.format(*args)
+        except Exception:
             try:
-                return text.format(*args)
+                return text % args
             except Exception:
-                try:
-                    return text % args
-                except Exception:
-                    return text
+                return text
 
-        def _emit(self, level: str, *args: Any, **kwargs: Any) -> None:
-            if not args:
-                message = ""
-            else:
-                message = self._format(args[0], tuple(args[1:]))
-            logging.log(getattr(logging, level.upper(), logging.INFO), message, **kwargs)
+    def _emit(self, level: str, *args: Any, **kwargs: Any) -> None:
+        if not args:
+            message = ""
+        else:
+            message = self._format(args[0], tuple(args[1:]))
+        logging.log(getattr(logging, level.upper(), logging.INFO), message, **kwargs)
 
-        def debug(self, *args: Any, **kwargs: Any) -> None:
-            self._emit("debug", *args, **kwargs)
+    def debug(self, *args: Any, **kwargs: Any) -> None:
+        self._emit("debug", *args, **kwargs)
 
-        def info(self, *args: Any, **kwargs: Any) -> None:
-            self._emit("info", *args, **kwargs)
+    def info(self, *args: Any, **kwargs: Any) -> None:
+        self._emit("info", *args, **kwargs)
 
-        def warning(self, *args: Any, **kwargs: Any) -> None:
-            self._emit("warning", *args, **kwargs)
+    def warning(self, *args: Any, **kwargs: Any) -> None:
+        self._emit("warning", *args, **kwargs)
 
-        def error(self, *args: Any, **kwargs: Any) -> None:
-            self._emit("error", *args, **kwargs)
+    def error(self, *args: Any, **kwargs: Any) -> None:
+        self._emit("error", *args, **kwargs)
 
-        def exception(self, *args: Any, **kwargs: Any) -> None:
-            self._emit("exception", *args, **kwargs)
+    def exception(self, *args: Any, **kwargs: Any) -> None:
+        self._emit("exception", *args, **kwargs)
 
-        def bind(self, **_kwargs: Any) -> "_FauxLogger":
-            return self
+    def bind(self, **_kwargs: Any) -> "_FauxLogger":
+        return self
+
+    def add(self, sink: Any, level: str = "INFO", **kwargs: Any) -> int:
+        logger_obj = logging.getLogger()
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        if hasattr(sink, "write"):
+            handler = logging.StreamHandler(stream=sink)
+        else:
+            # Файлов handler към същия път вече е закачен (напр. след reload) –
+            # не добавяме втори, за да не се дублира всеки ред в лога.
+            target = os.path.abspath(str(sink))
+            for existing in logger_obj.handlers:
+                if getattr(existing, "baseFilename", None) == target:
+                    return id(existing)
+            encoding = kwargs.get("encoding") or "utf-8"
+            handler = logging.FileHandler(sink, encoding=encoding)
+        handler.setLevel(getattr(logging, level.upper(), logging.INFO))
+        handler.setFormatter(formatter)
+        logger_obj.addHandler(handler)
+        self._handlers.append(handler)
+        return id(handler)
+
+    def remove(self, handler_id: Any | None = None) -> None:
+        logger_obj = logging.getLogger()
+        if handler_id is None:
+            targets = list(self._handlers)
+        else:
+            targets = [
+                handler for handler in self._handlers if id(handler) == handler_id
+            ]
+        for handler in targets:
+            try:
+                logger_obj.removeHandler(handler)
+            finally:
+                handler.close()
+                if handler in self._handlers:
+                    self._handlers.remove(handler)
+
+
+_LOGGER_IMPL: Any | None = None
+
+
+def _load_logger() -> Any:
+    """Импортира loguru при първа нужда (или връща заместителя)."""
+
+    global _LOGGER_IMPL
+    if _LOGGER_IMPL is not None:
+        return _LOGGER_IMPL
+    try:  # pragma: no cover - optional dependency
+        from loguru import logger as loguru_logger
+    except Exception:  # pragma: no cover - защитно
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s [%(levelname)s] %(message)s",
+        )
+        _LOGGER_IMPL = _FauxLogger()
+    else:
+        _LOGGER_IMPL = loguru_logger
+    return _LOGGER_IMPL
 
-        def add(self, sink: Any, level: str = "INFO", **kwargs: Any) -> int:
-            logger_obj = logging.getLogger()
-            formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-            if hasattr(sink, "write"):
-                handler = logging.StreamHandler(stream=sink)
-            else:
-                encoding = kwargs.get("encoding") or "utf-8"
-                handler = logging.FileHandler(sink, encoding=encoding)
-            handler.setLevel(getattr(logging, level.upper(), logging.INFO))
-            handler.setFormatter(formatter)
-            logger_obj.addHandler(handler)
-            self._handlers.append(handler)
-            return id(handler)
-
-        def remove(self, handler_id: Any | None = None) -> None:
-            logger_obj = logging.getLogger()
-            if handler_id is None:
-                targets = list(self._handlers)
-            else:
-                targets = [
-                    handler for handler in self._handlers if id(handler) == handler_id
-                ]
-            for handler in targets:
-                try:
-                    logger_obj.removeHandler(handler)
-                finally:
-                    handler.close()
-                    if handler in self._handlers:
-                        self._handlers.remove(handler)
 
-    logger = _FauxLogger()
+class _LazyLogger:
+    """Отлага импорта и конфигурацията на логъра до първото извикване."""
+
+    def __getattr__(self, item: str) -> Any:
+        _configure_logging()
+        return getattr(_load_logger(), item)
+
+
+logger = _LazyLogger()
 
 
 _LOG_CONFIGURED = False
-_CONN: Any | None = None
-_CUR: Any | None = None
-_PROFILE: Dict[str, Any] | None = None
-_PROFILE_LABEL: str | None = None
-_LOGIN_META: Dict[str, Any] | None = None
-_DELIVERY_TABLES: Dict[str, str] | None = None
-_DELIVERY_GENERATORS: Dict[str, Optional[str]] | None = None
-_TABLE_COLUMNS: Dict[str, Dict[str, Dict[str, Any]]] = {}
-_CATALOG_SCHEMA: Dict[str, str | None] | None = None
-_DELIVERY_CONTEXT: Dict[int, Dict[str, Any]] = {}
-_FIELD_LENGTH_CACHE: Dict[tuple[str, str], int] = {}
-_last_login_trace: List[Dict[str, Any]] = []
+_LOGURU_SINK_ID: Any | None = None
+
+
+class _LoginTraceBuf:
+    """Колонен буфер за стъпките на логина – по един списък на поле.
+
+    Честите полета (procedure/mode/rows/error) са отделни колони с None за
+    липсваща стойност; речник се създава само за останалите ключове.
+    """
+
+    __slots__ = ("actions", "ts_ns", "procedures", "modes", "rows", "errors", "extras")
+
+    def __init__(self) -> None:
+        self.actions: List[str] = []
+        self.ts_ns: List[int] = []
+        self.procedures: List[Optional[str]] = []
+        self.modes: List[Optional[str]] = []
+        self.rows: List[Optional[int]] = []
+        self.errors: List[Optional[str]] = []
+        self.extras: List[Optional[Dict[str, Any]]] = []
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def append(
+        self,
+        action: str,
+        ts_ns: int,
+        procedure: Optional[str] = None,
+        mode: Optional[str] = None,
+        rows: Optional[int] = None,
+        error: Optional[str] = None,
+        extras: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.actions.append(action)
+        self.ts_ns.append(ts_ns)
+        self.procedures.append(procedure)
+        self.modes.append(mode)
+        self.rows.append(rows)
+        self.errors.append(error)
+        self.extras.append(extras)
+
+    def clear(self) -> None:
+        for column in (
+            self.actions,
+            self.ts_ns,
+            self.procedures,
+            self.modes,
+            self.rows,
+            self.errors,
+            self.extras,
+        ):
+            column.clear()
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        entries: List[Dict[str, Any]] = []
+        for action, ts_ns, procedure, mode, rows, error, extras in zip(
+            self.actions,
+            self.ts_ns,
+            self.procedures,
+            self.modes,
+            self.rows,
+            self.errors,
+            self.extras,
+        ):
+            entry: Dict[str, Any] = {
+                "action": action,
+                "timestamp": datetime.fromtimestamp(ts_ns / 1_000_000_000).isoformat(
+                    timespec="seconds"
+                ),
+            }
+            if procedure is not None:
+                entry["procedure"] = procedure
+            if mode is not None:
+                entry["mode"] = mode
+            if rows is not None:
+                entry["rows"] = rows
+            if error is not None:
+                entry["error"] = error
+            if extras:
+                entry.update(extras)
+            entries.append(entry)
+        return entries
+
+
+class _ConnectionState(threading.local):
+    """Връзка, курсор и login състояние – отделни за всяка нишка."""
+
+    def __init__(self) -> None:
+        self.conn: Any | None = None
+        self.cur: Any | None = None
+        self.profile: Dict[str, Any] | None = None
+        self.profile_label: str | None = None
+        self.login_meta: Dict[str, Any] | None = None
+        self.login_trace = _LoginTraceBuf()
+        self.login_mode: str | None = None
+        self.login_error: str | None = None
+
+
+_tls = _ConnectionState()
+# Метаданните на схемата са общи за всички нишки – записът минава през lock.
+_CACHE_LOCK = threading.RLock()
+# Метаданните по база са с ключ (host, port, database) от _database_key() –
+# нишки към различни бази не си ги смесват, а connect() пипа само своята база.
+_DbKey = Tuple[str, int, str]
+# Преоткриването на TEMPDELIVERY след reconnect към същата база се пропуска.
+_DELIVERY_TABLES_BY_DB: Dict[_DbKey, Dict[str, str]] = {}
+_DELIVERY_GENERATORS_BY_DB: Dict[_DbKey, Dict[str, Optional[str]]] = {}
+# Редове на fetch за метаданни – драйверът ги тегли на пакети, а не по един.
+_METADATA_ARRAYSIZE = 200
+_RELATION_FIELDS_ARRAYSIZE = 1000
+_TABLE_COLUMNS: Dict[_DbKey, Dict[str, Dict[str, Dict[str, Any]]]] = {}
+_TABLE_UPPER_MAPS: Dict[_DbKey, Dict[str, Dict[str, str]]] = {}
+# Каталожната схема по връзка (id на connection) – различни профили/бази
+# не си пречат, а повторните търсения не удрят RDB$RELATION_FIELDS.
+_CATALOG_SCHEMAS: Dict[int, Dict[str, str | None]] = {}
+# Дължини на полета по (id на връзка, таблица, поле).
+_FIELD_LENGTH_CACHE: Dict[Tuple[int, str, str], int] = {}
+_DELIVERY_CONTEXT: Dict[_DbKey, Dict[int, Dict[str, Any]]] = {}
+_DELIVERY_DETAIL_PLANS: Dict[_DbKey, Dict[Tuple[str, str], "_DeliveryDetailPlan"]] = {}
+# Еднакъв SQL текст позволява на драйвера да преизползва подготвения statement.
+_INSERT_SQL_CACHE: Dict[Tuple[str, Tuple[str, ...]], str] = {}
 _CATALOG_PREVIEW_MATERIALS: List[Dict[str, str]] = []
 _CATALOG_PREVIEW_BARCODES: List[Dict[str, str]] = []
 _CATALOG_TABLES_READY: bool = False
-_LAST_LOGIN_MODE: str | None = None
-_LAST_LOGIN_ERROR: str | None = None
 
 
 def encode_password(raw_password: str) -> str:
@@ -150,9 +292,10 @@ def encode_password(raw_password: str) -> str:
 
 
 def _configure_logging() -> None:
-    global _LOG_CONFIGURED, logger
-    if _LOG_CONFIGURED:
+    global _LOG_CONFIGURED, _LOGURU_SINK_ID
+    if _LOGURU_SINK_ID is not None or _LOG_CONFIGURED:
         return
+    impl = _load_logger()
 
     log_dir = Path(__file__).resolve().parent / "logs"
     try:
@@ -167,16 +310,16 @@ def _configure_logging() -> None:
     ).upper() or "INFO"
 
     try:
-        logger.remove()
+        impl.remove()
     except Exception:  # pragma: no cover - защитно
         pass
 
-    logger.add(
+    impl.add(
         sys.stderr,
         level=log_level_name,
         enqueue=False,
     )
-    logger.add(
+    _LOGURU_SINK_ID = impl.add(
         log_dir / "app_{time:YYYYMMDD_HHmmss}.log",
         level=log_level_name,
         rotation="1 MB",
@@ -212,13 +355,22 @@ def _log_error(message: str, **kwargs: Any) -> None:
     _log_with_level("error", message, **kwargs)
 
 
-_configure_logging()
+_FDB_MODULE: Any | None = None
+_FDB_LOADED = False
 
 
-try:  # pragma: no cover - import guard
-    import fdb  # type: ignore
-except ImportError:  # pragma: no cover - може да липсва
-    fdb = None  # type: ignore
+def _load_fdb() -> Any | None:
+    """Зарежда fdb (и клиентската DLL) едва когато драйверът е нужен."""
+
+    global _FDB_MODULE, _FDB_LOADED
+    if not _FDB_LOADED:
+        try:  # pragma: no cover - import guard
+            import fdb  # type: ignore
+        except ImportError:  # pragma: no cover - може да липсва
+            fdb = None  # type: ignore
+        _FDB_MODULE = fdb
+        _FDB_LOADED = True
+    return _FDB_MODULE
 
 
 @runtime_checkable
@@ -380,6 +532,7 @@ class FdbClient(_BaseFbClient):
         password: str,
         charset: str,
     ) -> "FdbClient":
+        fdb = _load_fdb()
         if fdb is None:
             raise ImportError("fdb не е наличен")
         database_path = _normalize_database_path(database)
@@ -498,6 +651,7 @@ def _resolve_error_class(driver: str) -> Type[BaseException]:
             raise ImportError("firebird-driver не е наличен") from exc
         return FirebirdError  # type: ignore[return-value]
     if driver == "fdb":
+        fdb = _load_fdb()
         if fdb is None:
             raise ImportError("fdb не е наличен")
         error_cls = getattr(fdb, "DatabaseError", Exception)
@@ -600,13 +754,13 @@ def _optional_str(value: Any) -> Optional[str]:
 
 
 def _profile_label() -> str:
-    profile = _PROFILE or {}
+    profile = _tls.profile or {}
     for key in ("label", "name", "client", "profile", "profile_name"):
         value = profile.get(key)
         if value:
             return str(value)
-    if _PROFILE_LABEL:
-        return _PROFILE_LABEL
+    if _tls.profile_label:
+        return _tls.profile_label
     database = profile.get("database")
     if database:
         return str(database)
@@ -614,19 +768,19 @@ def _profile_label() -> str:
 
 
 def _require_connection() -> Any:
-    if _CONN is None:
+    if _tls.conn is None:
         raise MistralDBError(
             f"Няма активна връзка – опитайте отново (профил: {_profile_label()})."
         )
-    return _CONN
+    return _tls.conn
 
 
 def _require_cursor(
     conn: Any | None = None, cur: Any | None = None, profile_label: str | None = None
 ) -> Any:
     label = profile_label or _profile_label()
-    active_conn = conn if conn is not None else _CONN
-    active_cur = cur if cur is not None else _CUR
+    active_conn = conn if conn is not None else _tls.conn
+    active_cur = cur if cur is not None else _tls.cur
     if not active_conn or not active_cur:
         raise MistralDBError(f"Няма активна връзка – опитайте отново (профил: {label}).")
     return active_cur
@@ -649,22 +803,38 @@ def _mask_sensitive(value: Any) -> Any:
     return "***"
 
 
-def _trace(action: str, **info: Any) -> None:
-    entry: Dict[str, Any] = {
-        "action": action,
-        "timestamp": datetime.now().isoformat(timespec="seconds"),
-    }
-    for key, value in info.items():
-        key_lower = key.lower()
-        if "pass" in key_lower or "pwd" in key_lower:
-            entry[key] = _mask_sensitive(value)
-        else:
-            entry[key] = value
-    _last_login_trace.append(entry)
+# MV_LOGIN_TRACE=0 изключва записа на стъпките (напр. при масови логини).
+_TRACE_ENABLED = (
+    os.getenv("MV_LOGIN_TRACE") or os.getenv("MICROVISION_LOGIN_TRACE") or "1"
+).strip() != "0"
+
+
+def _trace(
+    action: str,
+    *,
+    procedure: Any = None,
+    mode: Any = None,
+    rows: Any = None,
+    error: Any = None,
+    **info: Any,
+) -> None:
+    if not _TRACE_ENABLED:
+        return
+    extras: Optional[Dict[str, Any]] = None
+    if info:
+        extras = {}
+        for key, value in info.items():
+            key_lower = key.lower()
+            if "pass" in key_lower or "pwd" in key_lower:
+                extras[key] = _mask_sensitive(value)
+            else:
+                extras[key] = value
+    _tls.login_trace.append(action, time.time_ns(), procedure, mode, rows, error, extras)
 
 
 def get_last_login_trace() -> List[Dict[str, Any]]:
-    return list(_last_login_trace)
+    # Речниците (и времето) се сглобяват едва при четене – записът остава евтин.
+    return _tls.login_trace.to_dicts()
 
 
 def get_connection_info() -> Dict[str, Any]:
@@ -707,11 +877,13 @@ def _table_meta_from_login_meta(meta: Optional[Dict[str, Any]]) -> Optional[Dict
 
 def _collect_table_login_candidates() -> List[Dict[str, Any]]:
     table_candidates: List[Dict[str, Any]] = []
-    for table_name in ("USERS", "LOGUSERS"):
-        cols = _table_columns(table_name)
+    login_tables = ("USERS", "LOGUSERS")
+    columns_by_table = _prefetch_table_columns(login_tables)
+    for table_name in login_tables:
+        cols = columns_by_table.get(table_name, {})
         if not cols:
             continue
-        upper_map = {col.upper(): col for col in cols}
+        upper_map = _table_upper_map(table_name)
         login_candidates = (
             "NAME",
             "LOGIN",
@@ -867,14 +1039,7 @@ def _field_type_name(
     return base
 
 
-def _table_columns(table: str) -> Dict[str, Dict[str, Any]]:
-    table = table.upper()
-    if table in _TABLE_COLUMNS:
-        return _TABLE_COLUMNS[table]
-    conn = _require_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
+_TABLE_COLUMNS_SQL = """
         SELECT
             TRIM(rf.rdb$field_name) AS col_name,
             COALESCE(rf.rdb$null_flag, 0) AS null_flag,
@@ -884,18 +1049,44 @@ def _table_columns(table: str) -> Dict[str, Dict[str, Any]]:
             f.rdb$field_length,
             f.rdb$field_precision,
             f.rdb$field_scale,
-            f.rdb$character_length
+            f.rdb$character_length,
+            TRIM(rf.rdb$relation_name) AS relation_name
         FROM rdb$relation_fields rf
         JOIN rdb$fields f ON f.rdb$field_name = rf.rdb$field_source
-        WHERE rf.rdb$relation_name = ?
-        ORDER BY rf.rdb$field_position
-        """,
-        (table,),
-    )
-    data: Dict[str, Dict[str, Any]] = {}
+        WHERE rf.rdb$relation_name IN ({placeholders})
+        ORDER BY rf.rdb$relation_name, rf.rdb$field_position
+        """
+
+
+def _prefetch_table_columns(tables: Sequence[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Колоните на няколко таблици – липсващите в кеша идват с една заявка.
+
+    Връща ``{ТАБЛИЦА: колони}`` за всички поискани таблици (``{}`` за
+    несъществуваща), без повторно четене от кеша, който друга нишка може
+    да изчисти междувременно.
+    """
+
+    db_key = _database_key()
+    cached = _TABLE_COLUMNS.get(db_key, {})
+    result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    missing: List[str] = []
+    for name in dict.fromkeys(table.upper() for table in tables):
+        columns = cached.get(name)
+        if columns is None:
+            missing.append(name)
+        else:
+            result[name] = columns
+    if not missing:
+        return result
+    conn = _require_connection()
+    cur = conn.cursor()
+    cur.arraysize = _RELATION_FIELDS_ARRAYSIZE
+    placeholders = ", ".join(["CAST(? AS CHAR(31))"] * len(missing))
+    cur.execute(_TABLE_COLUMNS_SQL.format(placeholders=placeholders), tuple(missing))
+    fetched: Dict[str, Dict[str, Dict[str, Any]]] = {name: {} for name in missing}
     for row in cur.fetchall():
-        name = row[0]
-        data[name] = {
+        data = fetched.setdefault((row[9] or "").upper(), {})
+        data[row[0]] = {
             "not_null": bool(row[1]),
             "field_type": row[3],
             "field_sub_type": row[4],
@@ -906,22 +1097,56 @@ def _table_columns(table: str) -> Dict[str, Dict[str, Any]]:
             "type_name": _field_type_name(row[3], row[4], row[5], row[6], row[7], row[8]),
         }
     cur.close()
-    _TABLE_COLUMNS[table] = data
-    return data
+    with _CACHE_LOCK:
+        _TABLE_COLUMNS.setdefault(db_key, {}).update(fetched)
+    result.update(fetched)
+    return result
 
 
-def _next_id(table: str, generator_hint: Optional[str]) -> int:
-    conn = _require_connection()
-    cur = conn.cursor()
-    if generator_hint:
-        cur.execute(f"SELECT GEN_ID({generator_hint}, 1) FROM RDB$DATABASE")
-        value = cur.fetchone()[0]
-        cur.close()
-        return int(value)
-    cur.execute(f"SELECT COALESCE(MAX(ID), 0) + 1 FROM {table}")
-    value = cur.fetchone()[0]
-    cur.close()
-    return int(value or 1)
+def _table_columns(table: str) -> Dict[str, Dict[str, Any]]:
+    table = table.upper()
+    return _prefetch_table_columns((table,)).get(table, {})
+
+
+def _table_upper_map(table: str) -> Dict[str, str]:
+    """Връща {ИМЕ_С_ГЛАВНИ: оригинално име} за колоните на таблицата (кеширано)."""
+
+    db_key = _database_key()
+    table = table.upper()
+    cached = _TABLE_UPPER_MAPS.get(db_key, {}).get(table)
+    if cached is not None:
+        return cached
+    upper_map = {col.upper(): col for col in _table_columns(table)}
+    with _CACHE_LOCK:
+        _TABLE_UPPER_MAPS.setdefault(db_key, {})[table] = upper_map
+    return upper_map
+
+
+def _reserve_ids(
+    table: str, generator_hint: Optional[str], count: int, cur: Any | None = None
+) -> int:
+    """Запазва ``count`` поредни ID-та с едно обръщение и връща първото.
+
+    При генератор се ползва ``GEN_ID(gen, count)``; иначе – ``MAX(ID) + 1``.
+    При подаден ``cur`` той се преизползва и не се затваря.
+    """
+
+    own_cursor = cur is None
+    if own_cursor:
+        cur = _require_connection().cursor()
+    try:
+        if generator_hint:
+            cur.execute(f"SELECT GEN_ID({generator_hint}, {int(count)}) FROM RDB$DATABASE")
+            return int(cur.fetchone()[0]) - int(count) + 1
+        cur.execute(f"SELECT COALESCE(MAX(ID), 0) + 1 FROM {table}")
+        return int(cur.fetchone()[0] or 1)
+    finally:
+        if own_cursor:
+            cur.close()
+
+
+def _next_id(table: str, generator_hint: Optional[str], cur: Any | None = None) -> int:
+    return _reserve_ids(table, generator_hint, 1, cur)
 
 
 def _collect_relation_columns(cur: Any) -> Dict[str, List[str]]:
@@ -1153,19 +1378,27 @@ def _detect_catalog_schema_from_map(columns_map: Dict[str, List[str]]) -> Dict[s
     return schema
 
 
+def _connection_key(cur: Any | None) -> int:
+    """id() на връзката на курсора (или на активната) – ключ за кешовете по връзка."""
+
+    conn = getattr(cur, "connection", None) if cur is not None else None
+    return id(conn if conn is not None else _tls.conn)
+
+
 def detect_catalog_schema(cur: Any | None = None, force_refresh: bool = False) -> Dict[str, str | None]:
     """Открива таблиците MATERIAL и BARCODE и ключовите им колони."""
 
-    global _CATALOG_SCHEMA
-    if _CATALOG_SCHEMA is not None and not force_refresh:
-        return dict(_CATALOG_SCHEMA)
+    schema_key = _connection_key(cur)
+    cached = _CATALOG_SCHEMAS.get(schema_key)
+    if cached is not None and not force_refresh:
+        return dict(cached)
 
     active_cur = _require_cursor(cur=cur)
 
     def _relation_columns(table: str) -> List[str]:
         sql = (
             "SELECT TRIM(RDB$FIELD_NAME) FROM RDB$RELATION_FIELDS "
-            "WHERE RDB$RELATION_NAME = ? ORDER BY RDB$FIELD_POSITION"
+            "WHERE RDB$RELATION_NAME = CAST(? AS CHAR(31)) ORDER BY RDB$FIELD_POSITION"
         )
         active_cur.execute(sql, (table.upper(),))
         rows = active_cur.fetchall() or []
@@ -1229,7 +1462,8 @@ def detect_catalog_schema(cur: Any | None = None, force_refresh: bool = False) -
         "code_id_col": "MATERIALCODE",
     }
 
-    _CATALOG_SCHEMA = dict(schema)
+    with _CACHE_LOCK:
+        _CATALOG_SCHEMAS[schema_key] = dict(schema)
     _log_info(
         f"Каталожна схема: MATERIAL({schema['materials_code']}) / BARCODE(code={barcode_code_col}, fk={barcode_fk_col})"
     )
@@ -1336,45 +1570,61 @@ def refresh_catalog_preview(cur: Any | None = None) -> Dict[str, Any]:
     return get_catalog_preview()
 
 
+def _D(value: Any) -> Decimal:
+    """Decimal без str() round-trip за стойности, които вече са Decimal/int."""
+
+    value_type = type(value)
+    if value_type is Decimal:
+        return value
+    if value_type is int:
+        return Decimal(value)
+    return Decimal(str(value))
+
+
 def _decimal_or_none(value: Any) -> Optional[Decimal]:
     if value in (None, ""):
         return None
     try:
-        return Decimal(str(value))
+        return _D(value)
     except (InvalidOperation, ValueError):
         return None
 
 
-def _row_to_catalog_item(row: Sequence[Any], columns: Sequence[str]) -> Dict[str, Any]:
-    mapping = {name.upper(): row[idx] for idx, name in enumerate(columns)}
-    result: Dict[str, Any] = {
-        "id": None,
-        "code": None,
-        "barcode": None,
-        "name": None,
-        "uom": None,
-        "price": None,
-        "vat": None,
-    }
-    if "ITEM_ID" in mapping:
+_CATALOG_ITEM_ALIASES: Tuple[str, ...] = (
+    "ITEM_ID",
+    "ITEM_CODE",
+    "ITEM_BARCODE",
+    "ITEM_NAME",
+    "ITEM_UOM",
+    "ITEM_PRICE",
+    "ITEM_VAT",
+)
+
+
+def _catalog_item_indices(columns: Sequence[str]) -> Tuple[Optional[int], ...]:
+    """Позициите на ITEM_* колоните в реда – смятат се веднъж на заявка."""
+
+    positions = {name.upper(): idx for idx, name in enumerate(columns)}
+    return tuple(positions.get(alias) for alias in _CATALOG_ITEM_ALIASES)
+
+
+def _row_to_catalog_item(row: Sequence[Any], indices: Sequence[Optional[int]]) -> Dict[str, Any]:
+    i_id, i_code, i_barcode, i_name, i_uom, i_price, i_vat = indices
+    item_id = None
+    if i_id is not None:
         try:
-            result["id"] = int(mapping["ITEM_ID"])
+            item_id = int(row[i_id])
         except Exception:
-            result["id"] = None
-    if "ITEM_CODE" in mapping:
-        result["code"] = _clean_string(mapping["ITEM_CODE"])
-    if "ITEM_BARCODE" in mapping:
-        result["barcode"] = _clean_string(mapping["ITEM_BARCODE"])
-    if "ITEM_NAME" in mapping:
-        result["name"] = _clean_string(mapping["ITEM_NAME"])
-    if "ITEM_UOM" in mapping:
-        result["uom"] = _clean_string(mapping["ITEM_UOM"])
-    if "ITEM_PRICE" in mapping:
-        result["price"] = _decimal_or_none(mapping["ITEM_PRICE"])
-    if "ITEM_VAT" in mapping:
-        vat_value = _decimal_or_none(mapping["ITEM_VAT"])
-        result["vat"] = vat_value
-    return result
+            item_id = None
+    return {
+        "id": item_id,
+        "code": None if i_code is None else _clean_string(row[i_code]),
+        "barcode": None if i_barcode is None else _clean_string(row[i_barcode]),
+        "name": None if i_name is None else _clean_string(row[i_name]),
+        "uom": None if i_uom is None else _clean_string(row[i_uom]),
+        "price": None if i_price is None else _decimal_or_none(row[i_price]),
+        "vat": None if i_vat is None else _decimal_or_none(row[i_vat]),
+    }
 
 
 def get_field_max_len(cur: Any, table: str, field: str) -> int:
@@ -1385,12 +1635,14 @@ def get_field_max_len(cur: Any, table: str, field: str) -> int:
     if not normalized_table or not normalized_field:
         return 255
 
-    cache_key = (normalized_table.upper(), normalized_field.upper())
+    active_cur = _require_cursor(cur=cur)
+    table_key = normalized_table.upper()
+    field_key = normalized_field.upper()
+    cache_key = (_connection_key(active_cur), table_key, field_key)
     cached = _FIELD_LENGTH_CACHE.get(cache_key)
     if cached is not None:
         return cached
 
-    active_cur = _require_cursor(cur=cur)
     sql = (
         "SELECT COALESCE(f.rdb$character_length, f.rdb$field_length) "
         "FROM rdb$relation_fields rf "
@@ -1399,7 +1651,7 @@ def get_field_max_len(cur: Any, table: str, field: str) -> int:
         "AND UPPER(rf.rdb$field_name) = ?"
     )
     try:
-        active_cur.execute(sql, cache_key)
+        active_cur.execute(sql, (table_key, field_key))
         row = active_cur.fetchone()
         if row and row[0]:
             length = int(row[0])
@@ -1408,7 +1660,8 @@ def get_field_max_len(cur: Any, table: str, field: str) -> int:
     except Exception:
         length = 255
 
-    _FIELD_LENGTH_CACHE[cache_key] = length
+    with _CACHE_LOCK:
+        _FIELD_LENGTH_CACHE[cache_key] = length
     return length
 
 
@@ -1635,7 +1888,7 @@ def get_item_by_barcode(cur: Any, barcode: str) -> Optional[Dict[str, Any]]:
     if not row:
         return None
     description = [desc[0].strip().upper() for desc in active_cur.description]
-    return _row_to_catalog_item(row, description or aliases)
+    return _row_to_catalog_item(row, _catalog_item_indices(description or aliases))
 
 
 def get_item_by_code(cur: Any, code: str) -> Optional[Dict[str, Any]]:
@@ -1676,7 +1929,7 @@ def get_item_by_code(cur: Any, code: str) -> Optional[Dict[str, Any]]:
     if not row:
         return None
     description = [desc[0].strip().upper() for desc in active_cur.description]
-    return _row_to_catalog_item(row, description or aliases)
+    return _row_to_catalog_item(row, _catalog_item_indices(description or aliases))
 
 
 def get_items_by_name(cur: Any, name_query: str, limit: int = 5) -> List[Dict[str, Any]]:
@@ -1732,8 +1985,8 @@ def get_items_by_name(cur: Any, name_query: str, limit: int = 5) -> List[Dict[st
     if not rows:
         return []
     description = [desc[0].strip().upper() for desc in active_cur.description]
-    columns = description or final_aliases
-    return [_row_to_catalog_item(row, columns) for row in rows]
+    indices = _catalog_item_indices(description or final_aliases)
+    return [_row_to_catalog_item(row, indices) for row in rows]
 
 
 def find_item_candidates_by_name(cur: Any, name: str, limit: int = 3) -> List[Dict[str, Any]]:
@@ -1749,6 +2002,43 @@ def _enrich_catalog_result(data: Dict[str, Any], match: str) -> Dict[str, Any]:
     return payload
 
 
+def _get_item_by_barcode_or_code(cur: Any, value: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Баркод и код с една заявка (UNION ALL с приоритет) – (match, артикул)."""
+
+    schema = detect_catalog_schema(cur)
+    barcode_table = schema.get("barcode_table")
+    barcode_col = schema.get("barcode_col")
+    barcode_fk = schema.get("barcode_mat_fk")
+    materials_table = schema.get("materials_table")
+    materials_code = schema.get("materials_code")
+    if not (barcode_table and barcode_col and barcode_fk and materials_table and materials_code):
+        # Без таблица с баркодове остава само търсенето по код.
+        item = get_item_by_code(cur, value)
+        return ("code", item) if item else None
+
+    select_clause, aliases = _catalog_select_clause(schema, include_barcode=True)
+    sql = (
+        f"SELECT * FROM (SELECT FIRST 1 1 AS MATCH_PRIO, {select_clause} "
+        f"FROM {barcode_table} B "
+        f"JOIN {materials_table} M ON B.{barcode_fk} = M.{materials_code} "
+        f"WHERE TRIM(B.{barcode_col}) = TRIM(?)) AS BY_BARCODE "
+        f"UNION ALL "
+        f"SELECT * FROM (SELECT FIRST 1 2 AS MATCH_PRIO, {select_clause} "
+        f"FROM {materials_table} M "
+        f"LEFT JOIN {barcode_table} B ON B.{barcode_fk} = M.{materials_code} "
+        f"WHERE UPPER(TRIM(M.{materials_code})) = UPPER(TRIM(?))) AS BY_CODE "
+        f"ORDER BY 1"
+    )
+    cur.execute(sql, (value, value))
+    row = cur.fetchone()
+    if not row:
+        return None
+    description = [desc[0].strip().upper() for desc in cur.description or ()]
+    columns = description or ["MATCH_PRIO"] + aliases
+    match = "barcode" if int(row[0]) == 1 else "code"
+    return match, _row_to_catalog_item(row, _catalog_item_indices(columns))
+
+
 def resolve_item(cur: Any, token: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
     """Резолвира артикул с приоритет: баркод → код → име."""
 
@@ -1758,17 +2048,11 @@ def resolve_item(cur: Any, token: str, limit: Optional[int] = None) -> List[Dict
 
     active_cur = _require_cursor(cur=cur)
 
-    item = get_item_by_barcode(active_cur, normalized)
-    if item:
-        enriched = dict(item)
-        enriched["match"] = "barcode"
-        enriched.setdefault("source", "db")
-        return [enriched]
-
-    item = get_item_by_code(active_cur, normalized)
-    if item:
+    exact = _get_item_by_barcode_or_code(active_cur, normalized)
+    if exact:
+        match, item = exact
         enriched = dict(item)
-        enriched["match"] = "code"
+        enriched["match"] = match
         enriched.setdefault("source", "db")
         return [enriched]
 
@@ -1791,35 +2075,46 @@ def resolve_item(cur: Any, token: str, limit: Optional[int] = None) -> List[Dict
     return results
 
 
+_DIGEST_HEX_LEN: Dict[str, int] = {"MD5": 32, "SHA1": 40, "SHA256": 64}
+_HEX_LEN_ALGO: Dict[int, Tuple[str, ...]] = {
+    length: (algo,) for algo, length in _DIGEST_HEX_LEN.items()
+}
+
+
+_HASHERS: Dict[str, Any] = {
+    "MD5": hashlib.md5,
+    "SHA1": hashlib.sha1,
+    "SHA256": hashlib.sha256,
+}
+
+
 def _hash_with_algo(plain: str, salt: Optional[str], algo: str) -> str:
     data = plain if salt in (None, "") else f"{plain}{salt}"
-    raw = data.encode("utf-8")
     if algo == "PLAIN":
         return data
-    if algo == "MD5":
-        return hashlib.md5(raw).hexdigest()
-    if algo == "SHA1":
-        return hashlib.sha1(raw).hexdigest()
-    if algo == "SHA256":
-        return hashlib.sha256(raw).hexdigest()
-    raise ValueError(f"Непознат hash алгоритъм: {algo}")
+    hasher = _HASHERS.get(algo)
+    if hasher is None:
+        raise ValueError(f"Непознат hash алгоритъм: {algo}")
+    return hasher(data.encode("utf-8")).hexdigest()
+
 
+def _is_hex(text: str) -> bool:
+    return all(c in "0123456789abcdefABCDEF" for c in text)
+
+
+def _guess_algorithms(stored: str, field_name: str, is_hex: Optional[bool] = None) -> List[str]:
+    """Кандидат алгоритми за вече strip-ната стойност от базата."""
 
-def _guess_algorithms(stored: str, field_name: str) -> List[str]:
-    stored = stored.strip()
     if not stored:
         return []
     algos: List[str] = ["PLAIN"]
-    is_hex = all(c in "0123456789abcdefABCDEF" for c in stored)
-    if len(stored) == 32 and is_hex:
-        algos.append("MD5")
-    elif len(stored) == 40 and is_hex:
-        algos.append("SHA1")
-    elif len(stored) == 64 and is_hex:
-        algos.append("SHA256")
-    else:
-        if "HASH" in field_name.upper() or is_hex:
-            algos.extend(["MD5", "SHA1", "SHA256"])
+    if is_hex is None:
+        is_hex = _is_hex(stored)
+    exact = _HEX_LEN_ALGO.get(len(stored)) if is_hex else None
+    if exact:
+        algos.extend(exact)
+    elif is_hex or "HASH" in field_name.upper():
+        algos.extend(["MD5", "SHA1", "SHA256"])
     return algos
 
 
@@ -1831,31 +2126,75 @@ def _match_password(
 ) -> Tuple[bool, bool]:
     if stored is None:
         return False, False
+    # Съхранената стойност се нормализира (strip/lower/bytes) само веднъж.
     stored_str = str(stored).strip()
     if not stored_str:
         return False, False
+    stored_lower = stored_str.lower()
+    # Сравняваме байтове: hexlify() дава директно малки букви, без .lower() на кандидата.
+    stored_b = stored_lower.encode("utf-8")
     salts_clean = [str(s) for s in salts if s not in (None, "")]
-    algos = _guess_algorithms(stored_str, field_name)
+    is_hex = _is_hex(stored_str)
+    algos = _guess_algorithms(stored_str, field_name, is_hex)
     if not algos:
         algos = ["PLAIN", "MD5", "SHA1", "SHA256"]
     for algo in algos:
+        # Hex digest с друга дължина не може да съвпадне – пропускаме хеширането.
+        digest_len = _DIGEST_HEX_LEN.get(algo)
+        if digest_len is not None and digest_len != len(stored_lower):
+            continue
+        hasher = _HASHERS.get(algo)
         for salt in [None] + salts_clean:
-            candidate = _hash_with_algo(plain, salt, algo)
-            if candidate.lower() == stored_str.lower():
+            data = plain if salt is None else f"{plain}{salt}"
+            if hasher is None:
+                candidate_b = data.lower().encode("utf-8")
+            else:
+                candidate_b = binascii.hexlify(hasher(data.encode("utf-8")).digest())
+            if hmac.compare_digest(candidate_b, stored_b):
                 return True, False
-    looks_hex = all(c in "0123456789abcdefABCDEF" for c in stored_str)
     unknown = bool(salts_clean)
-    if not unknown and looks_hex and len(stored_str) not in {32, 40, 64}:
+    if not unknown and is_hex and len(stored_str) not in _HEX_LEN_ALGO:
         unknown = True
     if not unknown and "HASH" in field_name.upper():
         unknown = True
     return False, unknown
 
 
+def _database_key() -> Tuple[str, int, str]:
+    """(host, port, database) на активния профил – ключ за кешовете по база."""
+
+    profile = _tls.profile or {}
+    host = str(profile.get("host") or "localhost").strip().lower()
+    try:
+        port = int(profile.get("port") or 3050)
+    except (TypeError, ValueError):
+        port = 3050
+    database = _normalize_database_path(profile.get("database") or "")
+    return host, port, database
+
+
+def invalidate_delivery_cache(db_key: Optional[Tuple[str, int, str]] = None) -> None:
+    """Изчиства кешираните TEMPDELIVERY таблици/генератори.
+
+    ``db_key`` е ``(host, port, database)`` – както го връща
+    :func:`_database_key`; без него се изчистват всички бази.
+    """
+
+    with _CACHE_LOCK:
+        if db_key is None:
+            _DELIVERY_TABLES_BY_DB.clear()
+            _DELIVERY_GENERATORS_BY_DB.clear()
+        else:
+            _DELIVERY_TABLES_BY_DB.pop(db_key, None)
+            _DELIVERY_GENERATORS_BY_DB.pop(db_key, None)
+
+
 def _ensure_delivery_meta(cur: Any) -> Tuple[str, str]:
-    global _DELIVERY_TABLES
-    if _DELIVERY_TABLES:
-        return _DELIVERY_TABLES["header"], _DELIVERY_TABLES["detail"]
+    db_key = _database_key()
+    cached = _DELIVERY_TABLES_BY_DB.get(db_key)
+    if cached:
+        return cached["header"], cached["detail"]
+    cur.arraysize = _METADATA_ARRAYSIZE
     cur.execute(
         """
         SELECT TRIM(r.rdb$relation_name)
@@ -1879,14 +2218,16 @@ def _ensure_delivery_meta(cur: Any) -> Tuple[str, str]:
         raise MistralDBError("Не намирам таблица за OPEN доставка (TEMPDELIVERY).")
     if not detail:
         raise MistralDBError("Не намирам таблица за редове на OPEN доставка (TEMPDELIVERYSDR).")
-    _DELIVERY_TABLES = {"header": header, "detail": detail}
+    with _CACHE_LOCK:
+        _DELIVERY_TABLES_BY_DB[db_key] = {"header": header, "detail": detail}
     return header, detail
 
 
 def _ensure_delivery_generators(cur: Any) -> Tuple[Optional[str], Optional[str]]:
-    global _DELIVERY_GENERATORS
-    if _DELIVERY_GENERATORS:
-        return _DELIVERY_GENERATORS["header"], _DELIVERY_GENERATORS["detail"]
+    db_key = _database_key()
+    cached = _DELIVERY_GENERATORS_BY_DB.get(db_key)
+    if cached:
+        return cached["header"], cached["detail"]
     cur.execute(
         """
         SELECT TRIM(rdb$generator_name)
@@ -1903,13 +2244,14 @@ def _ensure_delivery_generators(cur: Any) -> Tuple[Optional[str], Optional[str]]
             detail_gen = name
         else:
             header_gen = name
-    _DELIVERY_GENERATORS = {"header": header_gen, "detail": detail_gen}
+    with _CACHE_LOCK:
+        _DELIVERY_GENERATORS_BY_DB[db_key] = {"header": header_gen, "detail": detail_gen}
     return header_gen, detail_gen
 
 
 def connect(profile: Dict[str, Any]) -> Tuple[Any, Any]:
     """Установява връзка към Firebird и връща (connection, cursor)."""
-    global _CONN, _CUR, _PROFILE, _PROFILE_LABEL, _LOGIN_META, _ACTIVE_DRIVER, _FB_ERROR, _CONNECTION_INFO
+    global _ACTIVE_DRIVER, _FB_ERROR, _CONNECTION_INFO
     if "database" not in profile:
         raise MistralDBError("В профила липсва ключ 'database'.")
 
@@ -1958,15 +2300,21 @@ def connect(profile: Dict[str, Any]) -> Tuple[Any, Any]:
             f"Грешка при свързване към база (профил: {profile_label}). Проверете хост/порт/права."
         ) from exc
 
-    _CONN = conn
-    _CUR = cur
-    _PROFILE = dict(profile)
-    _PROFILE_LABEL = profile_label
-    _LOGIN_META = None
-    _DELIVERY_TABLES = None
-    _DELIVERY_GENERATORS = None
-    _TABLE_COLUMNS.clear()
-    _DELIVERY_CONTEXT.clear()
+    _tls.conn = conn
+    _tls.cur = cur
+    _tls.profile = dict(profile)
+    _tls.profile_label = profile_label
+    _tls.login_meta = None
+    db_key = _database_key()
+    with _CACHE_LOCK:
+        # Reconnect опреснява метаданните само на своята база – другите
+        # нишки/бази запазват кешовете си.
+        for cache in (_TABLE_COLUMNS, _TABLE_UPPER_MAPS, _DELIVERY_CONTEXT, _DELIVERY_DETAIL_PLANS):
+            cache.pop(db_key, None)
+        _FIELD_LENGTH_CACHE.clear()
+        # Ключът е id() на суровата драйверска връзка, която може да бъде
+        # преизползвана от новата – при reconnect кешът се изчиства изцяло.
+        _CATALOG_SCHEMAS.clear()
     _CONNECTION_INFO = dict(details)
     if _CONNECTION_INFO.get("charset") != charset:
         _CONNECTION_INFO["charset"] = charset
@@ -1976,35 +2324,21 @@ def connect(profile: Dict[str, Any]) -> Tuple[Any, Any]:
 
 
 def _set_login_status(mode: str, error: str | None = None) -> None:
-    global _LAST_LOGIN_MODE, _LAST_LOGIN_ERROR
-    _LAST_LOGIN_MODE = mode
-    _LAST_LOGIN_ERROR = error
+    _tls.login_mode = mode
+    _tls.login_error = error
 
 
 def get_last_login_status() -> Dict[str, Any]:
     """Връща обобщена информация за последния опит за вход."""
 
     status: Dict[str, Any] = {
-        "mode": _LAST_LOGIN_MODE,
+        "mode": _tls.login_mode,
     }
-    if _LAST_LOGIN_ERROR:
-        status["error"] = _LAST_LOGIN_ERROR
+    if _tls.login_error:
+        status["error"] = _tls.login_error
     return status
 
 
-def _procedure_exists(cur: Any, name: str) -> bool:
-    cur = _require_cursor(cur=cur)
-    cur.execute(
-        """
-        SELECT 1
-        FROM rdb$procedures
-        WHERE UPPER(TRIM(rdb$procedure_name)) = UPPER(TRIM(?))
-    """,
-        (name,),
-    )
-    return cur.fetchone() is not None
-
-
 def _coerce_int(value: Any, default: int) -> int:
     try:
         return int(value)
@@ -2087,9 +2421,16 @@ def check_login_credentials(
     )
 
     try:
+        # Проверката за CHECKUSERFORTABLENO идва в същия round-trip като USERS.
         active_cur.execute(
             """
-            SELECT COUNT(*) AS MATCHES
+            SELECT
+                COUNT(*) AS MATCHES,
+                (
+                    SELECT COUNT(*)
+                    FROM rdb$procedures
+                    WHERE rdb$procedure_name = 'CHECKUSERFORTABLENO'
+                ) AS HAS_TABLE_CHECK
             FROM USERS
             WHERE UPPER(NAME) = UPPER(?) AND TRIM(PASS) = TRIM(?)
             """,
@@ -2097,6 +2438,7 @@ def check_login_credentials(
         )
         row = active_cur.fetchone()
         matches = int(row[0]) if row and row[0] is not None else 0
+        has_table_check = bool(row[1]) if row and len(row) > 1 else False
         logger.debug("mistral_db:login users matches=%s", matches)
         if matches <= 0:
             _set_login_status("fallback", "Невалиден потребител/парола.")
@@ -2105,18 +2447,7 @@ def check_login_credentials(
         _set_login_status("fallback")
 
         use_table_check = effective_table_no is not None
-        procedure_available = False
-        if use_table_check:
-            try:
-                procedure_available = _procedure_exists(active_cur, "CHECKUSERFORTABLENO")
-            except Exception as exists_exc:  # pragma: no cover - защитно
-                logger.debug(
-                    "mistral_db:login unable to detect CHECKUSERFORTABLENO (%s) – will attempt",
-                    exists_exc,
-                )
-                procedure_available = True
-
-        if use_table_check and not procedure_available:
+        if use_table_check and not has_table_check:
             logger.warning(
                 "mistral_db:login CHECKUSERFORTABLENO missing – skipping permission check",
             )
@@ -2175,72 +2506,60 @@ def detect_login_method(cur: Any | None = None) -> Dict[str, Any]:
     """Открива дали се ползва LOGIN процедура или USERS/LOGUSERS."""
 
     profile_label = _profile_label()
-    cur = _require_cursor(_CONN, cur, profile_label)
+    cur = _require_cursor(_tls.conn, cur, profile_label)
     logger.debug("Откриване на login механизъм (профил: {}).", profile_label)
 
+    cur.arraysize = _METADATA_ARRAYSIZE
     cur.execute(
         """
-        SELECT TRIM(p.rdb$procedure_name), COALESCE(p.rdb$procedure_type, 2)
+        SELECT
+            TRIM(p.rdb$procedure_name) AS proc_name,
+            COALESCE(p.rdb$procedure_type, 2) AS proc_type,
+            IIF(POSITION('SUSPEND' IN UPPER(p.rdb$procedure_source)) > 0, 1, 0) AS has_suspend,
+            pp.rdb$parameter_type,
+            TRIM(pp.rdb$parameter_name) AS param_name,
+            pp.rdb$parameter_number,
+            f.rdb$field_type,
+            f.rdb$field_sub_type,
+            f.rdb$field_length,
+            f.rdb$field_precision,
+            f.rdb$field_scale,
+            f.rdb$character_length
         FROM rdb$procedures p
+        LEFT JOIN rdb$procedure_parameters pp ON pp.rdb$procedure_name = p.rdb$procedure_name
+        LEFT JOIN rdb$fields f ON f.rdb$field_name = pp.rdb$field_source
         WHERE (p.rdb$system_flag IS NULL OR p.rdb$system_flag = 0)
           AND (
             UPPER(p.rdb$procedure_name) LIKE '%LOGIN%'
             OR UPPER(p.rdb$procedure_name) LIKE '%USER%'
           )
-        ORDER BY 1
+        ORDER BY p.rdb$procedure_name, pp.rdb$parameter_type, pp.rdb$parameter_number
         """
     )
-    procs = cur.fetchall()
+    rows = cur.fetchall()
     table_candidates_cache: Optional[List[Dict[str, Any]]] = None
-    for raw_name, proc_type in procs:
+    # Един ред на параметър – групираме по име на процедура.
+    for raw_name, proc_rows_iter in groupby(rows, key=lambda row: row[0]):
         name = (raw_name or "").strip()
         if not name:
             continue
-        conn = getattr(cur, "connection", None) or _require_connection()
-        pcur = _require_cursor(conn, conn.cursor(), profile_label)
-        pcur.execute(
-            """
-            SELECT
-                COALESCE(pp.rdb$parameter_type, 0) AS param_type,
-                TRIM(pp.rdb$parameter_name) AS param_name,
-                COALESCE(pp.rdb$parameter_number, 0) AS param_number,
-                f.rdb$field_type,
-                f.rdb$field_sub_type,
-                f.rdb$field_length,
-                f.rdb$field_precision,
-                f.rdb$field_scale,
-                f.rdb$character_length
-            FROM rdb$procedure_parameters pp
-            JOIN rdb$fields f ON f.rdb$field_name = pp.rdb$field_source
-            WHERE pp.rdb$procedure_name = ?
-            ORDER BY param_type, param_number
-            """,
-            (name,),
-        )
+        proc_rows = list(proc_rows_iter)
+        proc_type = proc_rows[0][1]
+        has_suspend = bool(proc_rows[0][2])
         inputs: List[Dict[str, Any]] = []
         outputs: List[Dict[str, Any]] = []
-        for row in pcur.fetchall():
+        for row in proc_rows:
+            if row[4] is None:
+                continue
             entry = {
-                "name": row[1],
-                "position": int(row[2]),
-                "field_type": row[3],
-                "field_scale": row[7],
-                "type_name": _field_type_name(row[3], row[4], row[5], row[6], row[7], row[8]),
+                "name": row[4],
+                "position": int(row[5] or 0),
+                "field_type": row[6],
+                "field_scale": row[10],
+                "type_name": _field_type_name(row[6], row[7], row[8], row[9], row[10], row[11]),
             }
-            (inputs if row[0] == 0 else outputs).append(entry)
-        pcur.close()
-        source_cur = _require_cursor(conn, conn.cursor(), profile_label)
-        source_cur.execute(
-            "SELECT rdb$procedure_source FROM rdb$procedures WHERE rdb$procedure_name = ?",
-            (name,),
-        )
-        source_row = source_cur.fetchone()
-        source_cur.close()
-        source_text = (source_row[0] or "") if source_row else ""
-        source_upper = source_text.upper() if isinstance(source_text, str) else ""
-        sp_kind = "selectable" if int(proc_type or 2) == 1 else "executable"
-        if "SUSPEND" in source_upper:
-            sp_kind = "selectable"
+            (inputs if (row[3] or 0) == 0 else outputs).append(entry)
+        sp_kind = "selectable" if int(proc_type or 2) == 1 or has_suspend else "executable"
         if inputs:
             meta = {
                 "mode": "sp",
@@ -2299,7 +2618,6 @@ def detect_login_method(cur: Any | None = None) -> Dict[str, Any]:
 def login_user(username: str, password: str, *, pc_id: Any | None = None) -> Tuple[int, str]:
     """Връща (operator_id, operator_login) или вдига MistralDBError."""
 
-    global _LOGIN_META
     cur = _require_cursor()
     username = (username or "").strip()
     password = password or ""
@@ -2311,13 +2629,14 @@ def login_user(username: str, password: str, *, pc_id: Any | None = None) -> Tup
         _trace("missing_password", username=username)
         _log_warning("Отказан вход без парола.", profile=_profile_label(), username=username)
         raise MistralDBError("Моля, въведете парола.")
-    _last_login_trace.clear()
+    _tls.login_trace.clear()
     normalized_pc_id = _normalize_pc_id(pc_id)
     display_user = username or "<само парола>"
-    trace_payload: Dict[str, Any] = {"profile": _profile_label(), "username": display_user}
-    if normalized_pc_id is not None:
-        trace_payload["pc_id"] = normalized_pc_id
-    _trace("start", **trace_payload)
+    if _TRACE_ENABLED:
+        trace_payload: Dict[str, Any] = {"profile": _profile_label(), "username": display_user}
+        if normalized_pc_id is not None:
+            trace_payload["pc_id"] = normalized_pc_id
+        _trace("start", **trace_payload)
     log_payload: Dict[str, Any] = {"profile": _profile_label(), "username": display_user}
     if normalized_pc_id is not None:
         log_payload["pc_id"] = normalized_pc_id
@@ -2334,9 +2653,9 @@ def login_user(username: str, password: str, *, pc_id: Any | None = None) -> Tup
     if force_table:
         _trace("force_table_login", profile=_profile_label())
         _log_warning("Активиран е принудителен табличен логин.", profile=_profile_label())
-        if _LOGIN_META is None:
-            _LOGIN_META = detect_login_method(cur)
-        meta = _LOGIN_META or {}
+        if _tls.login_meta is None:
+            _tls.login_meta = detect_login_method(cur)
+        meta = _tls.login_meta or {}
         table_meta = _table_meta_from_login_meta(meta)
         _trace(
             "detected_mode",
@@ -2367,9 +2686,9 @@ def login_user(username: str, password: str, *, pc_id: Any | None = None) -> Tup
         )
         return _finalize_success(operator_id, operator_login)
 
-    if _LOGIN_META is None:
-        _LOGIN_META = detect_login_method(cur)
-    meta = _LOGIN_META or {}
+    if _tls.login_meta is None:
+        _tls.login_meta = detect_login_method(cur)
+    meta = _tls.login_meta or {}
     table_meta = _table_meta_from_login_meta(meta)
     _trace(
         "detected_mode",
@@ -2687,12 +3006,14 @@ def _login_via_procedure(
     placeholders = ", ".join(["?"] * len(inputs))
     sp_kind = (meta.get("sp_kind") or "executable").lower()
 
-    params_payload: Dict[str, Any] = {
-        "username": username or "<празно>",
-        "password": "***" if password else "",
-    }
-    if pc_id is not None:
-        params_payload["pc_id"] = pc_id
+    params_payload: Dict[str, Any] | None = None
+    if _TRACE_ENABLED:
+        params_payload = {
+            "username": username or "<празно>",
+            "password": "***" if password else "",
+        }
+        if pc_id is not None:
+            params_payload["pc_id"] = pc_id
 
     if pc_id is not None:
         _log_info(
@@ -2842,8 +3163,10 @@ def _login_via_users_table(
         clauses.insert(0, f"UPPER(TRIM({login_field})) = UPPER(TRIM(?))")
         params.insert(0, username_clean)
 
+    # Нужни са най-много два реда: първият за входа, вторият само за да
+    # разпознаем двусмислена парола – не четем цялата таблица.
     query_sql = (
-        f"SELECT {id_field}, {login_field}, {effective_pass_field} FROM {table} WHERE "
+        f"SELECT FIRST 2 {id_field}, {login_field}, {effective_pass_field} FROM {table} WHERE "
         + " AND ".join(clauses)
     )
     debug_params = (
@@ -3019,11 +3342,11 @@ def create_open_delivery(operator_id: int) -> int:
     header_table, _ = _ensure_delivery_meta(cur)
     header_gen, _ = _ensure_delivery_generators(cur)
     columns = _table_columns(header_table)
-    location_id = (_PROFILE or {}).get("location_id")
-    storage_id = (_PROFILE or {}).get("storage_id")
-    doc_type = (_PROFILE or {}).get("operation_doc_type")
+    location_id = (_tls.profile or {}).get("location_id")
+    storage_id = (_tls.profile or {}).get("storage_id")
+    doc_type = (_tls.profile or {}).get("operation_doc_type")
     now = datetime.now()
-    delivery_id = _next_id(header_table, header_gen)
+    delivery_id = _next_id(header_table, header_gen, cur)
 
     values: Dict[str, Any] = {"ID": delivery_id}
     if "OBEKTID" in columns and location_id is not None:
@@ -3057,13 +3380,12 @@ def create_open_delivery(operator_id: int) -> int:
     if "NOTE" in columns:
         values["NOTE"] = "MicroVision импорт от MicroVision Invoice Parser"
 
-    column_names = list(values.keys())
-    placeholders = ", ".join(["?"] * len(column_names))
-    sql = f"INSERT INTO {header_table} ({', '.join(column_names)}) VALUES ({placeholders})"
+    column_names = tuple(values.keys())
+    sql = _insert_sql(header_table, column_names)
     if os.getenv("MV_ENABLE_OPEN_DELIVERY", "").strip() == "1":
         try:
             with _transaction():
-                conn.cursor().execute(sql, [values[col] for col in column_names])
+                cur.execute(sql, [values[col] for col in column_names])
         except _FB_ERROR as exc:
             raise MistralDBError(f"Неуспешно създаване на OPEN доставка: {exc}") from exc
     else:
@@ -3073,10 +3395,149 @@ def create_open_delivery(operator_id: int) -> int:
             delivery_id=delivery_id,
         )
 
-    _DELIVERY_CONTEXT[delivery_id] = {"nomer": values.get("NOMER"), "header_table": header_table}
+    with _CACHE_LOCK:
+        _DELIVERY_CONTEXT.setdefault(_database_key(), {})[delivery_id] = {
+            "nomer": values.get("NOMER"),
+            "header_table": header_table,
+        }
     return delivery_id
 
 
+@dataclass(frozen=True)
+class _DeliveryDetailPlan:
+    """Разрешените колони на TEMPDELIVERYSDR – изчисляват се веднъж на база."""
+
+    header_has_nomer: bool
+    temp_id_col: Optional[str]
+    nomer_col: Optional[str]
+    obekt_col: Optional[str]
+    sklad_col: Optional[str]
+    art_col: Optional[str]
+    qty_col: Optional[str]
+    price_col: Optional[str]
+    price_vat_col: Optional[str]
+    sum_col: Optional[str]
+    sum_vat_col: Optional[str]
+    barcode_col: Optional[str]
+    sale_price_col: Optional[str]
+    sale_price_vat_col: Optional[str]
+    sum_sale_col: Optional[str]
+    sum_sale_vat_col: Optional[str]
+
+
+def _delivery_detail_plan(header_table: str, detail_table: str) -> _DeliveryDetailPlan:
+    db_key = _database_key()
+    key = (header_table.upper(), detail_table.upper())
+    cached = _DELIVERY_DETAIL_PLANS.get(db_key, {}).get(key)
+    if cached is not None:
+        return cached
+
+    columns_by_table = _prefetch_table_columns(key)
+    header_cols = columns_by_table.get(key[0], {})
+    detail_cols = columns_by_table.get(key[1], {})
+
+    def _find_col(*candidates: str) -> Optional[str]:
+        for name in candidates:
+            if name in detail_cols:
+                return name
+        return None
+
+    plan = _DeliveryDetailPlan(
+        header_has_nomer="NOMER" in header_cols,
+        temp_id_col=_find_col("TEMPDELIVERYID", "TEMPDELIVERY_ID", "HEADERID"),
+        nomer_col="NOMER" if "NOMER" in detail_cols else None,
+        obekt_col=_find_col("OBEKTID", "LOCATIONID"),
+        sklad_col=_find_col("CKLADID", "STORAGEID"),
+        art_col=_find_col("ARTNOMER", "MATERIALCODE", "ITEMCODE"),
+        qty_col=_find_col("QTY", "KOL", "KOLICHESTVO"),
+        price_col=_find_col("EDPRICE", "PRICE", "DELIVERYPRICE"),
+        price_vat_col=_find_col("EDPRICEDDS", "PRICEVAT"),
+        sum_col=_find_col("SUMA", "SUMPRICE"),
+        sum_vat_col=_find_col("SUMADDS", "SUMPRICEVAT"),
+        barcode_col=_find_col("BARCODE"),
+        sale_price_col=_find_col("SALESPRICE"),
+        sale_price_vat_col=_find_col("SALESPRICEDDS"),
+        sum_sale_col=_find_col("SUMASALESPRICE"),
+        sum_sale_vat_col=_find_col("SUMASALESPRICEDDS"),
+    )
+    with _CACHE_LOCK:
+        _DELIVERY_DETAIL_PLANS.setdefault(db_key, {})[key] = plan
+    return plan
+
+
+# DCURR/DQTY пазят до 4 знака – закръглят се само резултатите, входовете
+# (цена, количество, ДДС) участват в произведенията с пълната си точност.
+_AMOUNT_QUANT = Decimal("0.0001")
+
+
+def _quantize_amount(value: Decimal) -> Decimal:
+    return value.quantize(_AMOUNT_QUANT, rounding=ROUND_HALF_UP)
+
+
+# ДДС ставките са няколко (0/9/20) – множителят се смята веднъж на ставка.
+_VAT_FACTOR_CACHE: Dict[Any, Optional[Decimal]] = {}
+_VAT_FACTOR_CACHE_LIMIT = 64
+
+
+def _compute_vat_factor(vat: Any) -> Optional[Decimal]:
+    rate = _D(vat)
+    if not rate:
+        return None
+    return Decimal("1") + rate / Decimal("100")
+
+
+def _vat_factor(vat: Any) -> Optional[Decimal]:
+    """Множител 1 + ДДС/100; ``None`` при нулево ДДС (цената остава същата)."""
+
+    try:
+        return _VAT_FACTOR_CACHE[vat]
+    except KeyError:
+        pass
+    except TypeError:
+        return _compute_vat_factor(vat)
+    factor = _compute_vat_factor(vat)
+    if len(_VAT_FACTOR_CACHE) < _VAT_FACTOR_CACHE_LIMIT:
+        with _CACHE_LOCK:
+            _VAT_FACTOR_CACHE[vat] = factor
+    return factor
+
+
+def _compute_line_amounts(
+    qtys: Sequence[Decimal],
+    prices: Sequence[Decimal],
+    vat_factors: Sequence[Optional[Decimal]],
+) -> Tuple[List[Decimal], List[Decimal], List[Decimal]]:
+    """Цена с ДДС, сума и сума с ДДС за всички редове (ROUND_HALF_UP до 4 знака)."""
+
+    prices_vat: List[Decimal] = []
+    sums: List[Decimal] = []
+    sums_vat: List[Decimal] = []
+    for qty, price, factor in zip(qtys, prices, vat_factors):
+        price_vat = _quantize_amount(price * factor) if factor is not None else price
+        line_sum = _quantize_amount(price * qty)
+        prices_vat.append(price_vat)
+        sums.append(line_sum)
+        sums_vat.append(_quantize_amount(price_vat * qty) if factor is not None else line_sum)
+    return prices_vat, sums, sums_vat
+
+
+def _insert_sql(table: str, cols: Tuple[str, ...]) -> str:
+    key = (table, cols)
+    sql = _INSERT_SQL_CACHE.get(key)
+    if sql is None:
+        placeholders = ", ".join(["?"] * len(cols))
+        sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({placeholders})"
+        with _CACHE_LOCK:
+            _INSERT_SQL_CACHE[key] = sql
+    return sql
+
+
+def _insert_detail_rows(
+    cur: Any, table: str, cols: Tuple[str, ...], rows: List[List[Any]]
+) -> None:
+    cur.executemany(_insert_sql(table, cols), rows)
+
+
 def push_items_to_mistral(delivery_id: int, items: List[Dict[str, Any]]) -> None:
     """Вкарва редовете за доставка в TEMPDELIVERYSDR."""
     if not items:
@@ -3086,42 +3547,36 @@ def push_items_to_mistral(delivery_id: int, items: List[Dict[str, Any]]) -> None
     cur = conn.cursor()
     header_table, detail_table = _ensure_delivery_meta(cur)
     _, detail_gen = _ensure_delivery_generators(cur)
-    header_cols = _table_columns(header_table)
-    detail_cols = _table_columns(detail_table)
+    plan = _delivery_detail_plan(header_table, detail_table)
 
     nomer = None
-    if delivery_id in _DELIVERY_CONTEXT:
-        nomer = _DELIVERY_CONTEXT[delivery_id].get("nomer")
-    if nomer is None and "NOMER" in header_cols:
+    context = _DELIVERY_CONTEXT.get(_database_key(), {}).get(delivery_id)
+    if context:
+        nomer = context.get("nomer")
+    if nomer is None and plan.header_has_nomer:
         cur.execute(f"SELECT NOMER FROM {header_table} WHERE ID = ?", (delivery_id,))
         row = cur.fetchone()
         if row:
             nomer = row[0]
 
-    location_id = (_PROFILE or {}).get("location_id")
-    storage_id = (_PROFILE or {}).get("storage_id")
-
-    def _find_col(*candidates: str) -> Optional[str]:
-        for name in candidates:
-            if name in detail_cols:
-                return name
-        return None
-
-    temp_id_col = _find_col("TEMPDELIVERYID", "TEMPDELIVERY_ID", "HEADERID")
-    nomer_col = "NOMER" if "NOMER" in detail_cols else None
-    obekt_col = _find_col("OBEKTID", "LOCATIONID")
-    sklad_col = _find_col("CKLADID", "STORAGEID")
-    art_col = _find_col("ARTNOMER", "MATERIALCODE", "ITEMCODE")
-    qty_col = _find_col("QTY", "KOL", "KOLICHESTVO")
-    price_col = _find_col("EDPRICE", "PRICE", "DELIVERYPRICE")
-    price_vat_col = _find_col("EDPRICEDDS", "PRICEVAT")
-    sum_col = _find_col("SUMA", "SUMPRICE")
-    sum_vat_col = _find_col("SUMADDS", "SUMPRICEVAT")
-    barcode_col = _find_col("BARCODE")
-    sale_price_col = _find_col("SALESPRICE")
-    sale_price_vat_col = _find_col("SALESPRICEDDS")
-    sum_sale_col = _find_col("SUMASALESPRICE")
-    sum_sale_vat_col = _find_col("SUMASALESPRICEDDS")
+    location_id = (_tls.profile or {}).get("location_id")
+    storage_id = (_tls.profile or {}).get("storage_id")
+
+    temp_id_col = plan.temp_id_col
+    nomer_col = plan.nomer_col
+    obekt_col = plan.obekt_col
+    sklad_col = plan.sklad_col
+    art_col = plan.art_col
+    qty_col = plan.qty_col
+    price_col = plan.price_col
+    price_vat_col = plan.price_vat_col
+    sum_col = plan.sum_col
+    sum_vat_col = plan.sum_vat_col
+    barcode_col = plan.barcode_col
+    sale_price_col = plan.sale_price_col
+    sale_price_vat_col = plan.sale_price_vat_col
+    sum_sale_col = plan.sum_sale_col
+    sum_sale_vat_col = plan.sum_sale_vat_col
 
     if os.getenv("MV_ENABLE_OPEN_DELIVERY", "").strip() != "1":
         _log_info(
@@ -3131,20 +3586,21 @@ def push_items_to_mistral(delivery_id: int, items: List[Dict[str, Any]]) -> None
         )
         return
 
+    qty_list = [_D(item.get("qty", "0")) for item in items]
+    price_list = [_D(item.get("price", "0")) for item in items]
+    vat_list = [_vat_factor(item.get("vat", "0")) for item in items]
+    price_vat_list, sum_list, sum_vat_list = _compute_line_amounts(qty_list, price_list, vat_list)
+
     try:
         with _transaction():
-            for item in items:
-                detail_id = _next_id(detail_table, detail_gen)
-                qty = Decimal(str(item.get("qty", "0")))
-                price = Decimal(str(item.get("price", "0")))
-                vat = Decimal(str(item.get("vat", "0")))
-                price_with_vat = (price * (Decimal("1") + vat / Decimal("100"))).quantize(
-                    Decimal("0.0001"), rounding=ROUND_HALF_UP
-                ) if vat else price
-                sum_without_vat = (price * qty).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
-                sum_with_vat = (price_with_vat * qty).quantize(
-                    Decimal("0.0001"), rounding=ROUND_HALF_UP
-                ) if vat else sum_without_vat
+            first_detail_id = _reserve_ids(detail_table, detail_gen, len(items), cur)
+            # Редовете се групират по набора колони – по един executemany на група.
+            buckets: Dict[Tuple[str, ...], List[List[Any]]] = {}
+            for index, item in enumerate(items):
+                detail_id = first_detail_id + index
+                qty = qty_list[index]
+                price = price_list[index]
+                vat_factor = vat_list[index]
 
                 values: Dict[str, Any] = {"ID": detail_id}
                 if temp_id_col:
@@ -3162,36 +3618,30 @@ def push_items_to_mistral(delivery_id: int, items: List[Dict[str, Any]]) -> None
                 if price_col:
                     values[price_col] = price
                 if price_vat_col:
-                    values[price_vat_col] = price_with_vat
+                    values[price_vat_col] = price_vat_list[index]
                 if sum_col:
-                    values[sum_col] = sum_without_vat
+                    values[sum_col] = sum_list[index]
                 if sum_vat_col:
-                    values[sum_vat_col] = sum_with_vat
+                    values[sum_vat_col] = sum_vat_list[index]
                 if barcode_col and item.get("barcode"):
                     values[barcode_col] = item["barcode"]
                 if sale_price_col and item.get("sale_price") is not None:
-                    sale_price = Decimal(str(item.get("sale_price")))
+                    sale_price = _D(item.get("sale_price"))
                     values[sale_price_col] = sale_price
+                    sale_price_vat = sale_price
                     if sale_price_vat_col:
-                        sale_price_vat = (sale_price * (Decimal("1") + vat / Decimal("100"))).quantize(
-                            Decimal("0.0001"), rounding=ROUND_HALF_UP
-                        ) if vat else sale_price
+                        if vat_factor is not None:
+                            sale_price_vat = _quantize_amount(sale_price * vat_factor)
                         values[sale_price_vat_col] = sale_price_vat
                     if sum_sale_col:
-                        sum_sale = (sale_price * qty).quantize(
-                            Decimal("0.0001"), rounding=ROUND_HALF_UP
-                        )
-                        values[sum_sale_col] = sum_sale
+                        values[sum_sale_col] = _quantize_amount(sale_price * qty)
                     if sum_sale_vat_col:
-                        sum_sale_vat = (values.get(sale_price_vat_col, sale_price) * qty).quantize(
-                            Decimal("0.0001"), rounding=ROUND_HALF_UP
-                        )
-                        values[sum_sale_vat_col] = sum_sale_vat
-
-                cols = list(values.keys())
-                placeholders = ", ".join(["?"] * len(cols))
-                sql = f"INSERT INTO {detail_table} ({', '.join(cols)}) VALUES ({placeholders})"
-                conn.cursor().execute(sql, [values[col] for col in cols])
+                        values[sum_sale_vat_col] = _quantize_amount(sale_price_vat * qty)
+
+                cols = tuple(values.keys())
+                buckets.setdefault(cols, []).append([values[col] for col in cols])
+            for cols, rows in buckets.items():
+                _insert_detail_rows(cur, detail_table, cols, rows)
     except _FB_ERROR as exc:
         raise MistralDBError(f"Грешка при запис на артикули: {exc}") from exc
 
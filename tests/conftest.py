@@ -11,24 +11,63 @@ if str(ROOT_DIR) not in sys.path:
 
 import pytest
 
+import db_integration
 import mistral_db
 
 collect_ignore_glob = ["samples/db/test*.txt"]
 
 
+class _DummyConn:
+    def close(self) -> None:  # pragma: no cover - stub
+        pass
+
+
+# Общи stub-ове за patched_db_dependencies – създават се веднъж за модула.
+def _empty_dict() -> dict:
+    return {}
+
+
+def _catalog_not_loaded() -> bool:
+    return False
+
+
+def _load_catalog_stub(session: object, profile: object) -> tuple[int, int]:
+    return 0, 0
+
+
+def _ensure_connection_stub(session: object, label: object, profile: object) -> tuple[_DummyConn, _DummyConn]:
+    return _DummyConn(), _DummyConn()
+
+
+_DB_DEPENDENCY_OVERRIDES = {
+    "get_catalog_preview": _empty_dict,
+    "catalog_tables_loaded": _catalog_not_loaded,
+    "get_catalog_counts": _empty_dict,
+    "_load_catalog_for_profile": _load_catalog_stub,
+    "_ensure_connection": _ensure_connection_stub,
+}
+
+
 @pytest.fixture(autouse=True)
 def _fake_connection() -> None:
-    previous_conn = getattr(mistral_db, "_CONN", None)
-    previous_cur = getattr(mistral_db, "_CUR", None)
-    previous_schema = getattr(mistral_db, "_CATALOG_SCHEMA", None)
+    state = mistral_db._tls  # type: ignore[attr-defined]
+    previous_conn = state.conn
+    previous_cur = state.cur
+    previous_schemas = dict(mistral_db._CATALOG_SCHEMAS)  # type: ignore[attr-defined]
     sentinel = object()
-    mistral_db._CONN = sentinel  # type: ignore[attr-defined]
-    mistral_db._CUR = sentinel  # type: ignore[attr-defined]
-    mistral_db._CATALOG_SCHEMA = None  # type: ignore[attr-defined]
+    state.conn = sentinel
+    state.cur = sentinel
+    mistral_db._CATALOG_SCHEMAS.clear()  # type: ignore[attr-defined]
     try:
         yield
     finally:
-        mistral_db._CONN = previous_conn  # type: ignore[attr-defined]
-        mistral_db._CUR = previous_cur  # type: ignore[attr-defined]
-        mistral_db._CATALOG_SCHEMA = previous_schema  # type: ignore[attr-defined]
+        state.conn = previous_conn
+        state.cur = previous_cur
+        mistral_db._CATALOG_SCHEMAS.clear()  # type: ignore[attr-defined]
+        mistral_db._CATALOG_SCHEMAS.update(previous_schemas)  # type: ignore[attr-defined]
+
 
+@pytest.fixture
+def patched_db_dependencies(monkeypatch: pytest.MonkeyPatch) -> None:
+    for name, stub in _DB_DEPENDENCY_OVERRIDES.items():
+        monkeypatch.setattr(db_integration, name, stub, raising=False)
@@ -0,0 +1,76 @@
+"""Tests for the USERS login check with the folded CHECKUSERFORTABLENO probe."""
+from __future__ import annotations
+
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+import mistral_db
+
+
+class _LoginCursor:
+    def __init__(self, users_row: Tuple[Any, ...], allowed: str = "1") -> None:
+        self.users_row = users_row
+        self.allowed = allowed
+        self.executed: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.description: Optional[List[Tuple[Any, ...]]] = None
+        self._row: Optional[Tuple[Any, ...]] = None
+
+    def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        self.executed.append((sql, params))
+        if "CHECKUSERFORTABLENO(" in sql.upper():
+            self.description = [("CHRRESULT",)]
+            self._row = (self.allowed,)
+        else:
+            self.description = [("MATCHES",), ("HAS_TABLE_CHECK",)]
+            self._row = self.users_row
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return self._row
+
+
+@pytest.fixture(autouse=True)
+def _login_status(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(mistral_db._tls, "login_mode", None, raising=False)
+    monkeypatch.setattr(mistral_db._tls, "login_error", None, raising=False)
+
+
+def test_login_skips_permission_check_without_procedure() -> None:
+    cursor = _LoginCursor((1, 0))
+
+    assert mistral_db.check_login_credentials("test", "ROPO", cur=cursor) == (True, "Успешен вход.")
+    # Един round-trip: USERS и проверката в rdb$procedures са в една заявка.
+    assert len(cursor.executed) == 1
+    sql, params = cursor.executed[0]
+    assert "HAS_TABLE_CHECK" in sql
+    assert params == ("test", mistral_db.encode_password("ROPO"))
+
+
+@pytest.mark.parametrize(
+    ("allowed", "expected"),
+    [
+        ("1", (True, "Успешен вход.")),
+        ("0", (False, "Достъпът е отказан от CHECKUSERFORTABLENO.")),
+    ],
+)
+def test_login_runs_permission_check_when_procedure_exists(allowed, expected) -> None:
+    cursor = _LoginCursor((1, 1), allowed=allowed)
+
+    assert mistral_db.check_login_credentials("test", "ROPO", table_no=5, location_id=2, cur=cursor) == expected
+    assert len(cursor.executed) == 2
+    assert cursor.executed[1] == ("SELECT FIRST 1 * FROM CHECKUSERFORTABLENO(?, ?, ?)", (2, "test", 5))
+
+
+def test_login_without_table_no_ignores_procedure() -> None:
+    cursor = _LoginCursor((1, 1))
+
+    assert mistral_db.check_login_credentials("test", "ROPO", table_no=None, cur=cursor) == (True, "Успешен вход.")
+    assert len(cursor.executed) == 1
+
+
+def test_login_rejects_when_users_has_no_match() -> None:
+    cursor = _LoginCursor((0, 1))
+
+    assert mistral_db.check_login_credentials("test", "ROPO", cur=cursor) == (False, "Невалиден потребител/парола.")
+    assert len(cursor.executed) == 1
+    assert mistral_db.get_last_login_status() == {"mode": "fallback", "error": "Невалиден потребител/парола."}
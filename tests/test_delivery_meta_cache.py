@@ -0,0 +1,60 @@
+"""Tests for the per-database TEMPDELIVERY metadata cache."""
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+import pytest
+
+import mistral_db
+
+
+class _DeliveryMetaCursor:
+    def __init__(self) -> None:
+        self.execute_calls = 0
+        self._rows: List[Tuple[Any, ...]] = []
+
+    def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        self.execute_calls += 1
+        if "RDB$RELATIONS" in sql.upper():
+            self._rows = [("TEMPDELIVERY",), ("TEMPDELIVERYSDR",)]
+        else:
+            self._rows = []
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return list(self._rows)
+
+
+@pytest.fixture(autouse=True)
+def _reset_delivery_cache() -> None:
+    previous_profile = mistral_db._tls.profile
+    mistral_db.invalidate_delivery_cache()
+    yield
+    mistral_db.invalidate_delivery_cache()
+    mistral_db._tls.profile = previous_profile
+
+
+def test_delivery_meta_is_reused_per_database() -> None:
+    cursor = _DeliveryMetaCursor()
+    mistral_db._tls.profile = {"host": "localhost", "database": "shop.fdb"}
+    assert mistral_db._ensure_delivery_meta(cursor) == ("TEMPDELIVERY", "TEMPDELIVERYSDR")
+
+    mistral_db._tls.profile = {"host": "LOCALHOST", "database": "shop.fdb"}
+    assert mistral_db._ensure_delivery_meta(cursor) == ("TEMPDELIVERY", "TEMPDELIVERYSDR")
+    assert cursor.execute_calls == 1
+
+    mistral_db._tls.profile = {"host": "localhost", "database": "test.fdb"}
+    mistral_db._ensure_delivery_meta(cursor)
+    assert cursor.execute_calls == 2
+
+    mistral_db.invalidate_delivery_cache(("localhost", 3050, "test.fdb"))
+    mistral_db._ensure_delivery_meta(cursor)
+    assert cursor.execute_calls == 3
+
+    # Друг сървър на същия хост (друг порт) със същия път не споделя кеша.
+    mistral_db._tls.profile = {"host": "localhost", "port": 3051, "database": "test.fdb"}
+    mistral_db._ensure_delivery_meta(cursor)
+    assert cursor.execute_calls == 4
+
+    mistral_db._tls.profile = {"host": "localhost", "port": "3050", "database": "test.fdb"}
+    mistral_db._ensure_delivery_meta(cursor)
+    assert cursor.execute_calls == 4
@@ -0,0 +1,72 @@
+"""Tests for login procedure discovery over the joined rdb$ metadata rows."""
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+import pytest
+
+import mistral_db
+
+# (proc_name, proc_type, has_suspend, param_type, param_name, param_number,
+#  field_type, sub_type, length, precision, scale, char_length)
+_NO_PARAMS = ("APP_LOGIN_CHECK", 2, 0, None, None, None, None, None, None, None, None, None)
+_OUTPUTS_ONLY = ("USER_INFO", 2, 0, 1, "USER_NAME", 0, 37, 0, 40, None, 0, 10)
+_LOGIN_ROWS = [
+    ("USER_LOGIN", 2, 1, 0, "LOGIN_NAME", 0, 37, 0, 40, None, 0, 10),
+    ("USER_LOGIN", 2, 1, 0, "LOGIN_PASS", 1, 37, 0, 40, None, 0, 10),
+    ("USER_LOGIN", 2, 1, 1, "USER_ID", 0, 8, 0, 4, 0, 0, None),
+]
+
+
+class _ProcedureCursor:
+    def __init__(self, rows: List[Tuple[Any, ...]]) -> None:
+        self.rows = rows
+        self.arraysize = 1
+        self.execute_calls = 0
+
+    def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        self.execute_calls += 1
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return list(self.rows)
+
+
+@pytest.fixture(autouse=True)
+def _no_login_tables(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(mistral_db, "_collect_table_login_candidates", lambda: [])
+
+
+def test_detect_login_method_picks_first_procedure_with_inputs() -> None:
+    cursor = _ProcedureCursor([_NO_PARAMS, _OUTPUTS_ONLY] + _LOGIN_ROWS)
+
+    meta = mistral_db.detect_login_method(cursor)
+
+    assert cursor.execute_calls == 1
+    assert meta["mode"] == "sp"
+    assert meta["name"] == "USER_LOGIN"
+    assert meta["sp_kind"] == "selectable"
+    assert "fallback_table" not in meta
+    assert meta["fields"]["inputs"] == [
+        {"name": "LOGIN_NAME", "position": 0, "field_type": 37, "field_scale": 0, "type_name": "VARCHAR(10)"},
+        {"name": "LOGIN_PASS", "position": 1, "field_type": 37, "field_scale": 0, "type_name": "VARCHAR(10)"},
+    ]
+    assert meta["fields"]["outputs"] == [
+        {"name": "USER_ID", "position": 0, "field_type": 8, "field_scale": 0, "type_name": "INTEGER"},
+    ]
+
+
+@pytest.mark.parametrize(
+    ("proc_type", "has_suspend", "expected"),
+    [(1, 0, "selectable"), (2, 1, "selectable"), (2, 0, "executable"), (None, 0, "executable")],
+)
+def test_detect_login_method_sp_kind(proc_type, has_suspend, expected) -> None:
+    rows = [(row[0], proc_type, has_suspend) + row[3:] for row in _LOGIN_ROWS]
+    meta = mistral_db.detect_login_method(_ProcedureCursor(rows))
+    assert meta["sp_kind"] == expected
+
+
+def test_detect_login_method_without_input_procedures_falls_back_to_users() -> None:
+    meta = mistral_db.detect_login_method(_ProcedureCursor([_NO_PARAMS, _OUTPUTS_ONLY]))
+    assert meta["mode"] == "table"
+    assert meta["name"] == "USERS"
+    assert meta["sp_kind"] is None
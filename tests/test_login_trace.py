@@ -0,0 +1,42 @@
+"""Tests for the columnar login trace buffer."""
+from __future__ import annotations
+
+import pytest
+
+import mistral_db
+
+
+@pytest.fixture(autouse=True)
+def _fresh_trace(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(mistral_db, "_TRACE_ENABLED", True)
+    monkeypatch.setattr(mistral_db._tls, "login_trace", mistral_db._LoginTraceBuf())
+
+
+def test_trace_keeps_common_fields_in_columns() -> None:
+    mistral_db._trace("sp_select", procedure="APP_LOGIN", mode="select", rows=1)
+    mistral_db._trace("table_lookup", mode="plain", table="USERS", password="secret")
+    mistral_db._trace("login_failure", error="Невалидна парола.")
+
+    buf = mistral_db._tls.login_trace
+    assert len(buf) == 3
+    assert buf.procedures == ["APP_LOGIN", None, None]
+    assert buf.modes == ["select", "plain", None]
+    assert buf.errors == [None, None, "Невалидна парола."]
+    # Речник се създава само за ключове извън колоните.
+    assert buf.extras == [None, {"table": "USERS", "password": "***"}, None]
+
+    entries = mistral_db.get_last_login_trace()
+    assert [entry["action"] for entry in entries] == ["sp_select", "table_lookup", "login_failure"]
+    assert {k: v for k, v in entries[0].items() if k != "timestamp"} == {
+        "action": "sp_select",
+        "procedure": "APP_LOGIN",
+        "mode": "select",
+        "rows": 1,
+    }
+    assert entries[1]["table"] == "USERS"
+    assert entries[1]["password"] == "***"
+    assert "procedure" not in entries[2]
+    assert entries[2]["error"] == "Невалидна парола."
+
+    buf.clear()
+    assert mistral_db.get_last_login_trace() == []
@@ -1,11 +1,16 @@
 import unittest
 from unittest.mock import patch
 
+import pytest
+
 import mistral_db
 
+pytestmark = pytest.mark.xdist_group("mistral_db")
+
 
 class FakeCursorFieldLen:
-    def __init__(self):
+    def __init__(self, connection=None):
+        self.connection = connection
         self.execute_calls = 0
         self.last_params = None
 
@@ -18,23 +23,64 @@ class FakeCursorFieldLen:
 
 
 class FakeCursorItems:
+    _DESCRIPTION = (
+        ("ITEM_ID", None, None, None, None, None, None),
+        ("ITEM_CODE", None, None, None, None, None, None),
+        ("ITEM_NAME", None, None, None, None, None, None),
+        ("ITEM_BARCODE", None, None, None, None, None, None),
+    )
+
     def __init__(self):
-        self.description = []
+        self.description = ()
         self.executed_sql = ""
-        self.executed_params = []
+        self.last_params = None
 
     def execute(self, sql, params):
         self.executed_sql = sql
-        self.executed_params.append(params)
+        self.last_params = params
+        self.description = self._DESCRIPTION
+
+    def fetchall(self):
+        return [(1, "ABC", "Test Name", "123")]
+
+
+class FakeCursorExactLookup:
+    def __init__(self, row):
+        self.row = row
+        self.description = []
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
         self.description = [
+            ("MATCH_PRIO", None, None, None, None, None, None),
             ("ITEM_ID", None, None, None, None, None, None),
             ("ITEM_CODE", None, None, None, None, None, None),
-            ("ITEM_NAME", None, None, None, None, None, None),
             ("ITEM_BARCODE", None, None, None, None, None, None),
+            ("ITEM_NAME", None, None, None, None, None, None),
         ]
 
+    def fetchone(self):
+        return self.row
+
+
+class FakeCursorSchema:
+    _COLUMNS = {
+        "MATERIAL": [("MATERIALCODE",), ("MATERIAL",)],
+        "BARCODE": [("CODE",), ("FK_STORAGEMATERIALCODE",)],
+    }
+
+    def __init__(self, connection=None):
+        self.connection = connection
+        self.execute_calls = 0
+        self._rows = []
+
+    def execute(self, sql, params):
+        self.execute_calls += 1
+        self._rows = list(self._COLUMNS.get(params[0], []))
+
     def fetchall(self):
-        return [(1, "ABC", "Test Name", "123")]
+        return self._rows
 
 
 class MistralDBLookupTests(unittest.TestCase):
@@ -51,6 +97,15 @@ class MistralDBLookupTests(unittest.TestCase):
         self.assertEqual(cursor.execute_calls, 1)
         self.assertEqual(cursor.last_params, ("MATERIAL", "NAME"))
 
+    def test_get_field_max_len_is_cached_per_cursor_connection(self):
+        cursor = FakeCursorFieldLen(connection=object())
+        other = FakeCursorFieldLen(connection=object())
+        mistral_db.get_field_max_len(cursor, "MATERIAL", "NAME")
+        mistral_db.get_field_max_len(other, "MATERIAL", "NAME")
+        mistral_db.get_field_max_len(other, "MATERIAL", "NAME")
+        self.assertEqual(cursor.execute_calls, 1)
+        self.assertEqual(other.execute_calls, 1)
+
     def test_get_items_by_name_truncates_parameter(self):
         cursor = FakeCursorItems()
         schema = {
@@ -71,10 +126,74 @@ class MistralDBLookupTests(unittest.TestCase):
                     items = mistral_db.get_items_by_name(cursor, "   Дълго   име   ", limit=2)
         self.assertTrue(items)
         self.assertIn("CONTAINING ?", cursor.executed_sql)
-        self.assertEqual(cursor.executed_params[0][0], "Дълго")
+        self.assertEqual(cursor.last_params[0], "Дълго")
         self.assertEqual(items[0]["code"], "ABC")
         self.assertEqual(items[0]["barcode"], "123")
 
+    def test_resolve_item_looks_up_barcode_and_code_in_one_query(self):
+        cursor = FakeCursorExactLookup((2, 7, "ABC", "123", "Test Name"))
+        schema = {
+            "materials_table": "MATERIAL",
+            "materials_name": "MATERIAL",
+            "materials_code": "MATERIALCODE",
+            "materials_id": "ID",
+            "materials_uom": None,
+            "materials_price": None,
+            "materials_vat": None,
+            "barcode_table": "BARCODE",
+            "barcode_col": "CODE",
+            "barcode_mat_fk": "STORAGEMATERIALCODE",
+        }
+        with patch.object(mistral_db, "detect_catalog_schema", return_value=schema):
+            with patch.object(mistral_db, "_require_cursor", return_value=cursor):
+                items = mistral_db.resolve_item(cursor, " ABC ")
+        self.assertEqual(len(cursor.executed), 1)
+        sql, params = cursor.executed[0]
+        self.assertIn("UNION ALL", sql)
+        self.assertEqual(params, ("ABC", "ABC"))
+        self.assertEqual(items[0]["match"], "code")
+        self.assertEqual(items[0]["id"], 7)
+        self.assertEqual(items[0]["barcode"], "123")
+
+    def test_detect_catalog_schema_is_cached_per_connection(self):
+        cursor = FakeCursorSchema(connection=object())
+        first = mistral_db.detect_catalog_schema(cur=cursor)
+        second = mistral_db.detect_catalog_schema(cur=cursor)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first["barcode_col"], "CODE")
+        self.assertEqual(cursor.execute_calls, 2)
+
+        other = FakeCursorSchema(connection=object())
+        mistral_db.detect_catalog_schema(cur=other)
+        self.assertEqual(other.execute_calls, 2)
+
+        mistral_db.detect_catalog_schema(cur=cursor, force_refresh=True)
+        self.assertEqual(cursor.execute_calls, 4)
+
+    def test_connect_drops_cached_catalog_schemas(self):
+        raw_conn = object()
+        cursor = FakeCursorSchema(connection=raw_conn)
+        mistral_db.detect_catalog_schema(cur=cursor)
+
+        class WrapperConn:
+            def cursor(self):
+                return cursor
+
+        state = mistral_db._tls
+        saved = {name: getattr(state, name) for name in ("profile", "profile_label", "login_meta")}
+        self.addCleanup(lambda: [setattr(state, name, value) for name, value in saved.items()])
+        with patch.object(mistral_db, "_select_driver", return_value=("fdb", Exception)), patch.object(
+            mistral_db, "_connect_raw", return_value=(WrapperConn(), {})
+        ), patch.object(mistral_db, "_ACTIVE_DRIVER", mistral_db._ACTIVE_DRIVER), patch.object(
+            mistral_db, "_FB_ERROR", mistral_db._FB_ERROR
+        ), patch.object(mistral_db, "_CONNECTION_INFO", {}):
+            mistral_db.connect({"database": "other.fdb"})
+
+        # Новата връзка ползва същата сурова връзка (същото id) – схемата се открива наново.
+        mistral_db.detect_catalog_schema(cur=cursor)
+        self.assertEqual(cursor.execute_calls, 4)
+
 
 if __name__ == "__main__":
     unittest.main()
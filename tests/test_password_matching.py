@@ -0,0 +1,56 @@
+"""Tests that pin the behaviour of the Python-side password matcher."""
+from __future__ import annotations
+
+import hashlib
+
+import pytest
+
+import mistral_db
+
+
+def _hex(algo: str, data: str) -> str:
+    return hashlib.new(algo, data.encode("utf-8")).hexdigest()
+
+
+@pytest.mark.parametrize(
+    ("stored", "salts", "field_name"),
+    [
+        ("ROPO", [], "PASS"),
+        ("  ropo  ", [], "PASS"),
+        (_hex("md5", "ROPO"), [], "PASS"),
+        (_hex("sha1", "ROPO").upper(), [], "PASS"),
+        (_hex("sha256", "ROPO"), [], "PASSHASH"),
+        (_hex("md5", "ROPOs1"), [None, "", "s1"], "PASS"),
+        (_hex("sha256", "ROPO42"), [42], "PASS"),
+        ("ROPOs1", ["s1"], "PASS"),
+    ],
+)
+def test_match_password_accepts_known_encodings(stored, salts, field_name) -> None:
+    assert mistral_db._match_password("ROPO", stored, salts, field_name) == (True, False)
+
+
+@pytest.mark.parametrize(
+    ("stored", "salts", "field_name", "expected"),
+    [
+        (None, [], "PASS", (False, False)),
+        ("   ", ["s1"], "PASS", (False, False)),
+        ("other", [], "PASS", (False, False)),
+        ("other", ["s1"], "PASS", (False, True)),
+        ("other", [], "PASSHASH", (False, True)),
+        ("deadbeef", [], "PASS", (False, True)),
+        (_hex("md5", "other"), [], "PASS", (False, False)),
+        (_hex("sha1", "ROPO")[:-1] + "0", [], "PASS", (False, False)),
+    ],
+)
+def test_match_password_rejects_and_flags_unknown_formats(stored, salts, field_name, expected) -> None:
+    assert mistral_db._match_password("ROPO", stored, salts, field_name) == expected
+
+
+def test_guess_algorithms_uses_digest_length() -> None:
+    assert mistral_db._guess_algorithms("", "PASS") == []
+    assert mistral_db._guess_algorithms("ROPO", "PASS") == ["PLAIN"]
+    assert mistral_db._guess_algorithms("a" * 32, "PASS") == ["PLAIN", "MD5"]
+    assert mistral_db._guess_algorithms("A" * 40, "PASS") == ["PLAIN", "SHA1"]
+    assert mistral_db._guess_algorithms("0" * 64, "PASS") == ["PLAIN", "SHA256"]
+    assert mistral_db._guess_algorithms("abcd", "PASS") == ["PLAIN", "MD5", "SHA1", "SHA256"]
+    assert mistral_db._guess_algorithms("ROPO", "PASSHASH") == ["PLAIN", "MD5", "SHA1", "SHA256"]
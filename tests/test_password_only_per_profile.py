@@ -8,21 +8,14 @@ import pytest
 import catalog_store
 import db_integration
 
-
-class DummyConn:
-    def close(self) -> None:  # pragma: no cover - stub
-        pass
+pytestmark = pytest.mark.xdist_group("db_profiles")
 
 
 @pytest.fixture(autouse=True)
-def _reset_state(monkeypatch: pytest.MonkeyPatch) -> None:
+def _reset_state() -> None:
     catalog_store.clear()
-    monkeypatch.setattr(db_integration, "_PROFILE_CACHE", None, raising=False)
-    monkeypatch.setattr(db_integration, "_PASSWORD_ONLY_CACHE", None, raising=False)
     yield
     catalog_store.clear()
-    monkeypatch.setattr(db_integration, "_PROFILE_CACHE", None, raising=False)
-    monkeypatch.setattr(db_integration, "_PASSWORD_ONLY_CACHE", None, raising=False)
 
 
 @pytest.fixture
@@ -38,36 +31,23 @@ def profiles(monkeypatch: pytest.MonkeyPatch) -> dict[str, dict[str, object]]:
         },
     }
 
+    # monkeypatch връща оригиналните стойности след теста.
+    monkeypatch.setattr(db_integration, "_PROFILE_CACHE", None)
+    monkeypatch.setattr(db_integration, "_PASSWORD_ONLY_CACHE", None)
     monkeypatch.setattr(db_integration, "_load_profiles", lambda: payload, raising=False)
-    monkeypatch.setattr(
-        db_integration,
-        "_load_profile",
-        lambda key: dict(payload[key]),
-        raising=False,
-    )
+    monkeypatch.setattr(db_integration, "_load_profile", payload.__getitem__, raising=False)
     return payload
 
 
 @pytest.fixture
-def patched_dependencies(monkeypatch: pytest.MonkeyPatch) -> None:
-    monkeypatch.setattr(db_integration, "get_catalog_preview", lambda: {}, raising=False)
-    monkeypatch.setattr(db_integration, "catalog_tables_loaded", lambda: False, raising=False)
-    monkeypatch.setattr(db_integration, "get_catalog_counts", lambda: {}, raising=False)
-    monkeypatch.setattr(
-        db_integration,
-        "_load_catalog_for_profile",
-        lambda session, profile: (0, 0),
-        raising=False,
-    )
-    monkeypatch.setattr(
-        db_integration,
-        "_ensure_connection",
-        lambda session, label, profile: (DummyConn(), DummyConn()),
-        raising=False,
-    )
-
-
-def test_password_only_success_and_scoped(monkeypatch: pytest.MonkeyPatch, profiles, patched_dependencies) -> None:
+def make_session(profiles: dict[str, dict[str, object]]):
+    def _make(name: str) -> types.SimpleNamespace:
+        return types.SimpleNamespace(profile_name=name, profile_data=profiles[name], output_logger=None)
+
+    return _make
+
+
+def test_password_only_success_and_scoped(monkeypatch: pytest.MonkeyPatch, make_session, patched_db_dependencies) -> None:
     login_calls: list[tuple[str, str]] = []
 
     def fake_login_user(username: str, password: str, *, pc_id=None):
@@ -76,14 +56,14 @@ def test_password_only_success_and_scoped(monkeypatch: pytest.MonkeyPatch, profi
 
     monkeypatch.setattr(db_integration, "login_user", fake_login_user, raising=False)
 
-    session = types.SimpleNamespace(profile_name="Local TEST", profile_data=profiles["Local TEST"], output_logger=None)
+    session = make_session("Local TEST")
 
     result = db_integration.perform_login(session, "", "4321", profile_key="Local TEST")
     assert result["login"] == "test"
     assert session.profile_label == "Local TEST"
     assert login_calls == [("test", "4321")]
 
-    session_fail = types.SimpleNamespace(profile_name="Книжарница", profile_data=profiles["Книжарница"], output_logger=None)
+    session_fail = make_session("Книжарница")
     failure = db_integration.perform_login(session_fail, "", "4321", profile_key="Книжарница")
     assert "error" in failure
     assert failure["error"] == "Невалидна парола."
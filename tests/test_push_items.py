@@ -0,0 +1,184 @@
+"""Tests for writing OPEN delivery rows into TEMPDELIVERYSDR."""
+from __future__ import annotations
+
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+import mistral_db
+
+_DETAIL_COLUMNS = (
+    "ID",
+    "TEMPDELIVERYID",
+    "NOMER",
+    "OBEKTID",
+    "CKLADID",
+    "ARTNOMER",
+    "QTY",
+    "EDPRICE",
+    "EDPRICEDDS",
+    "SUMA",
+    "SUMADDS",
+    "BARCODE",
+    "SALESPRICE",
+    "SALESPRICEDDS",
+    "SUMASALESPRICE",
+    "SUMASALESPRICEDDS",
+)
+
+
+class _PushCursor:
+    def __init__(self, last_generated_id: int) -> None:
+        self.last_generated_id = last_generated_id
+        self.executed: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.executemany_calls: List[Tuple[str, List[List[Any]]]] = []
+        self.arraysize = 1
+        self._rows: List[Tuple[Any, ...]] = []
+
+    def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        self.executed.append((sql, params))
+        sql_upper = sql.upper()
+        if "RDB$RELATIONS" in sql_upper:
+            self._rows = [("TEMPDELIVERY",), ("TEMPDELIVERYSDR",)]
+        elif "RDB$GENERATORS" in sql_upper:
+            self._rows = [("GEN_TEMPDELIVERY",), ("GEN_TEMPDELIVERYSDR",)]
+        elif "GEN_ID" in sql_upper:
+            self._rows = [(self.last_generated_id,)]
+        else:
+            self._rows = []
+
+    def executemany(self, sql: str, rows: List[List[Any]]) -> None:
+        self.executemany_calls.append((sql, list(rows)))
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return list(self._rows)
+
+    def close(self) -> None:
+        pass
+
+
+class _PushConnection:
+    def __init__(self, cursor: _PushCursor) -> None:
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self) -> _PushCursor:
+        return self._cursor
+
+    def begin(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:  # pragma: no cover - не се очаква в теста
+        pass
+
+
+def _q(value: Decimal) -> Decimal:
+    return value.quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+
+
+def _expected_row(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Формулата отпреди целочислената оптимизация – Decimal и quantize на резултата."""
+
+    qty = Decimal(str(item.get("qty", "0")))
+    price = Decimal(str(item.get("price", "0")))
+    vat = Decimal(str(item.get("vat", "0")))
+    factor = Decimal("1") + vat / Decimal("100")
+    price_vat = _q(price * factor) if vat else price
+    line_sum = _q(price * qty)
+    row: Dict[str, Any] = {
+        "QTY": qty,
+        "EDPRICE": price,
+        "EDPRICEDDS": price_vat,
+        "SUMA": line_sum,
+        "SUMADDS": _q(price_vat * qty) if vat else line_sum,
+    }
+    if item.get("barcode"):
+        row["BARCODE"] = item["barcode"]
+    if item.get("sale_price") is not None:
+        sale_price = Decimal(str(item["sale_price"]))
+        sale_price_vat = _q(sale_price * factor) if vat else sale_price
+        row["SALESPRICE"] = sale_price
+        row["SALESPRICEDDS"] = sale_price_vat
+        row["SUMASALESPRICE"] = _q(sale_price * qty)
+        row["SUMASALESPRICEDDS"] = _q(sale_price_vat * qty)
+    return row
+
+
+@pytest.fixture
+def push_cursor(monkeypatch: pytest.MonkeyPatch) -> _PushCursor:
+    cursor = _PushCursor(last_generated_id=104)
+    monkeypatch.setenv("MV_ENABLE_OPEN_DELIVERY", "1")
+    monkeypatch.setattr(mistral_db._tls, "conn", _PushConnection(cursor))
+    monkeypatch.setattr(
+        mistral_db._tls,
+        "profile",
+        {"host": "localhost", "database": "push.fdb", "location_id": 3, "storage_id": 4},
+    )
+    monkeypatch.setattr(mistral_db, "_DELIVERY_TABLES_BY_DB", {})
+    monkeypatch.setattr(mistral_db, "_DELIVERY_GENERATORS_BY_DB", {})
+    db_key = mistral_db._database_key()
+    monkeypatch.setattr(mistral_db, "_DELIVERY_DETAIL_PLANS", {})
+    monkeypatch.setattr(mistral_db, "_DELIVERY_CONTEXT", {db_key: {7: {"nomer": 55}}})
+    monkeypatch.setattr(
+        mistral_db,
+        "_TABLE_COLUMNS",
+        {
+            db_key: {
+                "TEMPDELIVERY": {"ID": {}, "NOMER": {}},
+                "TEMPDELIVERYSDR": {name: {} for name in _DETAIL_COLUMNS},
+            }
+        },
+    )
+    return cursor
+
+
+def test_push_items_matches_decimal_amounts_and_batches_inserts(push_cursor: _PushCursor) -> None:
+    items = [
+        {"code": "11", "qty": 100, "price": "0.12345", "vat": 20, "barcode": "380001"},
+        {"code": "12", "qty": "3", "price": "1.23456", "vat": "0"},
+        {"code": "13", "qty": "-2.5", "price": "1.00005", "vat": "9", "sale_price": "-1.99995"},
+        {"code": "14", "qty": Decimal("0.33333"), "price": 2.5, "vat": Decimal("20"), "barcode": "380004"},
+        {"code": "15", "qty": "7", "price": "0.00015", "vat": 20.0, "sale_price": "3.45678"},
+    ]
+
+    mistral_db.push_items_to_mistral(7, items)
+
+    gen_calls = [sql for sql, _ in push_cursor.executed if "GEN_ID" in sql.upper()]
+    assert gen_calls == ["SELECT GEN_ID(GEN_TEMPDELIVERYSDR, 5) FROM RDB$DATABASE"]
+
+    column_sets = []
+    rows_by_id: Dict[int, Dict[str, Any]] = {}
+    for sql, rows in push_cursor.executemany_calls:
+        cols = tuple(part.strip() for part in sql.split("(", 1)[1].split(")", 1)[0].split(","))
+        column_sets.append(cols)
+        for row in rows:
+            values = dict(zip(cols, row))
+            rows_by_id[values["ID"]] = values
+    # Три различни набора колони: с баркод, без баркод/продажна цена, с продажна цена.
+    assert len(column_sets) == len(set(column_sets)) == 3
+    assert sorted(rows_by_id) == [100, 101, 102, 103, 104]
+
+    for offset, item in enumerate(items):
+        values = rows_by_id[100 + offset]
+        assert values["TEMPDELIVERYID"] == 7
+        assert values["NOMER"] == 55
+        assert values["OBEKTID"] == 3
+        assert values["CKLADID"] == 4
+        assert values["ARTNOMER"] == int(item["code"])
+        for column, expected in _expected_row(item).items():
+            assert values[column] == expected, (item["code"], column)
+
+    first = rows_by_id[100]
+    assert (first["EDPRICEDDS"], first["SUMA"], first["SUMADDS"]) == (
+        Decimal("0.1481"),
+        Decimal("12.3450"),
+        Decimal("14.8100"),
+    )
+    assert rows_by_id[101]["SUMA"] == Decimal("3.7037")
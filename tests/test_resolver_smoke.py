@@ -3,22 +3,42 @@
 from __future__ import annotations
 
 import json
+import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Any, List, Mapping, Optional, Tuple
+
+import pytest
 
 import db_integration
 
+pytestmark = pytest.mark.xdist_group("resolver")
+
 
 FIXTURES_DIR = Path(__file__).with_name("fixtures")
+_SAMPLE_PATH = FIXTURES_DIR / "firsttenmaterialbookstore.TXT"
 
 
 class _ResolverCursor:
-    def __init__(self, material_rows: List[Tuple[Any, ...]]) -> None:
-        self.material_rows = material_rows
-        self.metadata: Dict[str, List[str]] = {
-            "MATERIAL": ["MATERIALCODE", "MATERIAL"],
-            "BARCODE": ["CODE", "FK_STORAGEMATERIALCODE"],
+    _METADATA: Mapping[str, Tuple[str, ...]] = MappingProxyType(
+        {
+            "MATERIAL": ("MATERIALCODE", "MATERIAL"),
+            "BARCODE": ("CODE", "FK_STORAGEMATERIALCODE"),
         }
+    )
+    _METADATA_RE = re.compile(r"RDB\$RELATION_FIELDS", re.IGNORECASE)
+    _IN_LIST_RE = re.compile(r"\sIN\s*\(", re.IGNORECASE)
+    _MATERIAL_RE = re.compile(r"\bJOIN\b|\bFROM\s+MATERIAL\b", re.IGNORECASE)
+
+    def __init__(
+        self,
+        material_rows: List[Tuple[Any, ...]],
+        barcode_rows: Optional[List[Tuple[Any, ...]]] = None,
+    ) -> None:
+        self.material_rows = material_rows
+        self.barcode_rows = barcode_rows or []
+        self.catalog_queries = 0
         self.last_sql: Optional[str] = None
         self.last_params: Tuple[Any, ...] = ()
         self._rows: List[Tuple[Any, ...]] = []
@@ -26,12 +46,16 @@ class _ResolverCursor:
     def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
         self.last_sql = sql
         self.last_params = params
-        sql_upper = sql.upper()
-        if "RDB$RELATION_FIELDS" in sql_upper:
+        if self._METADATA_RE.search(sql):
             table = str(params[0]).upper()
-            cols = self.metadata.get(table, [])
+            cols = self._METADATA.get(table, ())
             self._rows = [(col,) for col in cols]
-        elif "JOIN" in sql_upper or "FROM MATERIAL" in sql_upper:
+            return
+        self.catalog_queries += 1
+        if self._IN_LIST_RE.search(sql):
+            wanted = set(params)
+            self._rows = [row for row in self.barcode_rows if row[0] in wanted]
+        elif self._MATERIAL_RE.search(sql):
             self._rows = list(self.material_rows)
         else:
             self._rows = []
@@ -43,10 +67,9 @@ class _ResolverCursor:
         return list(self._rows)
 
 
+@lru_cache(maxsize=1)
 def _load_sample_name() -> str:
-    content = FIXTURES_DIR.joinpath("firsttenmaterialbookstore.TXT").read_text(
-        encoding="cp1251", errors="ignore"
-    )
+    content = _SAMPLE_PATH.read_text(encoding="cp1251", errors="ignore")
     for line in content.splitlines():
         line = line.strip()
         if line and not line.startswith("=") and not line.startswith("MATERIAL"):
@@ -65,6 +88,24 @@ def test_resolver_generates_expected_barcode_sql() -> None:
     assert cursor.last_params == ("1234567890123",)
 
 
+def test_resolver_resolves_barcodes_in_one_query() -> None:
+    cursor = _ResolverCursor(
+        [],
+        barcode_rows=[("111", "1", "Първи"), ("222", "2", "Втори"), ("999", "9", "Друг")],
+    )
+    resolver = db_integration.DbItemResolver(cursor)
+    cursor.catalog_queries = 0
+    codes = ["111", " 222 ", "333", "111"]
+    hits = resolver.resolve_barcodes(codes)
+    assert hits == {
+        "111": {"code": "1", "name": "Първи"},
+        "222": {"code": "2", "name": "Втори"},
+    }
+    assert cursor.catalog_queries == 1
+    assert (cursor.last_sql or "").count("?") == 3
+    assert cursor.last_params == ("111", "222", "333")
+
+
 def test_resolver_generates_name_query() -> None:
     sample = _load_sample_name()
     cursor = _ResolverCursor([("77", sample)])
@@ -79,10 +120,12 @@ def test_mapping_normalization_and_persistence(tmp_path: Path) -> None:
     mapping_path = tmp_path / "mapping.json"
     mapping = db_integration.Mapping(mapping_path)
     sample_text = "  Тетрадка   линия   "
+    db_integration.Mapping.normalize_text.cache_clear()
     mapping.set_mapped_text("Книжарница", sample_text, "105")
     mapping.set_mapped_barcode("Книжарница", "0123456789", "105")
     data = json.loads(mapping_path.read_text(encoding="utf-8"))
     normalized = db_integration.Mapping.normalize_text(sample_text)
+    assert db_integration.Mapping.normalize_text.cache_info().hits >= 1
     supplier = data["suppliers"]["Книжарница"]
     assert supplier["by_text"][normalized] == "105"
     assert supplier["by_barcode"]["0123456789"] == "105"
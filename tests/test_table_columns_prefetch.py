@@ -0,0 +1,78 @@
+"""Tests for the batched rdb$relation_fields lookup behind _table_columns."""
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+import pytest
+
+import mistral_db
+
+# (col_name, null_flag, field_source, field_type, sub_type, length,
+#  precision, scale, char_length, relation_name)
+_USERS_ROWS = [
+    ("ID", 1, "RDB$1", 8, 0, 4, 0, 0, None, "USERS"),
+    ("NAME", 0, "RDB$2", 37, 0, 40, None, 0, 10, "USERS"),
+]
+_LOGUSERS_ROWS = [
+    ("LOGIN", 1, "RDB$3", 37, 0, 80, None, 0, 20, "LOGUSERS"),
+]
+
+
+class _RelationFieldsCursor:
+    def __init__(self, executed: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        self.executed = executed
+        self.arraysize = 1
+        self._rows: List[Tuple[Any, ...]] = []
+
+    def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        self.executed.append((sql, params))
+        self._rows = [row for row in _USERS_ROWS + _LOGUSERS_ROWS if row[9] in params]
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return list(self._rows)
+
+    def close(self) -> None:
+        pass
+
+
+class _RelationFieldsConnection:
+    def __init__(self) -> None:
+        self.executed: List[Tuple[str, Tuple[Any, ...]]] = []
+
+    def cursor(self) -> _RelationFieldsCursor:
+        return _RelationFieldsCursor(self.executed)
+
+
+@pytest.fixture
+def connection(monkeypatch: pytest.MonkeyPatch) -> _RelationFieldsConnection:
+    conn = _RelationFieldsConnection()
+    monkeypatch.setattr(mistral_db._tls, "conn", conn)
+    monkeypatch.setattr(mistral_db._tls, "profile", {"host": "localhost", "database": "prefetch.fdb"})
+    monkeypatch.setattr(mistral_db, "_TABLE_COLUMNS", {})
+    return conn
+
+
+def test_prefetch_splits_rows_by_table_and_caches_missing(connection: _RelationFieldsConnection) -> None:
+    result = mistral_db._prefetch_table_columns(("users", "NOSUCH", "Users"))
+
+    assert len(connection.executed) == 1
+    assert connection.executed[0][1] == ("USERS", "NOSUCH")
+    assert sorted(result) == ["NOSUCH", "USERS"]
+    assert list(result["USERS"]) == ["ID", "NAME"]
+    assert result["USERS"]["ID"]["not_null"] is True
+    assert result["USERS"]["NAME"]["type_name"] == "VARCHAR(10)"
+    assert result["NOSUCH"] == {}
+
+    # Втори достъп – и несъществуващата таблица е в кеша, без нова заявка.
+    assert mistral_db._table_columns("users") is result["USERS"]
+    assert mistral_db._table_columns("nosuch") == {}
+    assert len(connection.executed) == 1
+
+
+def test_prefetch_queries_only_tables_missing_from_cache(connection: _RelationFieldsConnection) -> None:
+    mistral_db._table_columns("USERS")
+    result = mistral_db._prefetch_table_columns(("USERS", "LOGUSERS"))
+
+    assert [params for _, params in connection.executed] == [("USERS",), ("LOGUSERS",)]
+    assert list(result["USERS"]) == ["ID", "NAME"]
+    assert list(result["LOGUSERS"]) == ["LOGIN"]
@@ -0,0 +1,98 @@
+"""Tests that table metadata caches stay isolated between threads and databases."""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+import mistral_db
+
+_USERS_COLUMNS = {
+    "db1.fdb": ("NAME", "PASS"),
+    "db2.fdb": ("LOGIN", "PASSWD", "ID"),
+}
+
+
+class _MetadataCursor:
+    def __init__(self, database: str) -> None:
+        self.database = database
+        self.arraysize = 1
+        self.execute_calls = 0
+        self._rows: List[Tuple[Any, ...]] = []
+
+    def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> None:
+        self.execute_calls += 1
+        self._rows = [
+            (column, 0, f"RDB${column}", 37, 0, 40, None, 0, 10, table)
+            for table in params
+            if table == "USERS"
+            for column in _USERS_COLUMNS[self.database]
+        ]
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return list(self._rows)
+
+    def close(self) -> None:
+        pass
+
+
+class _MetadataConnection:
+    def __init__(self, cursor: _MetadataCursor) -> None:
+        self._cursor = cursor
+
+    def cursor(self) -> _MetadataCursor:
+        return self._cursor
+
+
+@pytest.fixture(autouse=True)
+def _isolated_caches(monkeypatch: pytest.MonkeyPatch) -> None:
+    for name in ("_TABLE_COLUMNS", "_TABLE_UPPER_MAPS", "_DELIVERY_CONTEXT", "_DELIVERY_DETAIL_PLANS"):
+        monkeypatch.setattr(mistral_db, name, {})
+    monkeypatch.setattr(mistral_db, "_ACTIVE_DRIVER", mistral_db._ACTIVE_DRIVER)
+    monkeypatch.setattr(mistral_db, "_FB_ERROR", mistral_db._FB_ERROR)
+    monkeypatch.setattr(mistral_db, "_CONNECTION_INFO", {})
+    monkeypatch.setattr(mistral_db, "_select_driver", lambda profile: ("fdb", Exception))
+    monkeypatch.setattr(
+        mistral_db,
+        "_connect_raw",
+        lambda host, port, database, *args: (_MetadataConnection(_MetadataCursor(database)), {}),
+    )
+
+
+def test_table_columns_are_isolated_per_thread_database() -> None:
+    barrier = threading.Barrier(2)
+    results: Dict[str, List[Any]] = {}
+    errors: List[BaseException] = []
+
+    def worker(database: str, reconnect: bool) -> None:
+        try:
+            conn, _ = mistral_db.connect({"database": database})
+            cursor = conn.cursor()
+            seen = [sorted(mistral_db._table_columns("USERS"))]
+            barrier.wait()
+            # Втората нишка прави reconnect – кешът на първата база остава.
+            if reconnect:
+                conn, _ = mistral_db.connect({"database": database})
+                cursor = conn.cursor()
+            barrier.wait()
+            seen.append(sorted(mistral_db._table_columns("USERS")))
+            seen.append(cursor.execute_calls)
+            results[database] = seen
+        except BaseException as exc:  # pragma: no cover - предава се към теста
+            errors.append(exc)
+            barrier.abort()
+
+    threads = [
+        threading.Thread(target=worker, args=("db1.fdb", False)),
+        threading.Thread(target=worker, args=("db2.fdb", True)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert not errors
+    assert results["db1.fdb"] == [["NAME", "PASS"], ["NAME", "PASS"], 1]
+    # След reconnect към db2 колоните се четат наново от новата връзка.
+    assert results["db2.fdb"] == [["ID", "LOGIN", "PASSWD"], ["ID", "LOGIN", "PASSWD"], 1]